@@ -59,6 +59,9 @@ fn link_wrapper() -> pkg_config::Library {
 fn build_wrapper(opencv: pkg_config::Library) {
     println!("cargo:rerun-if-changed=hdr_parser.py");
     println!("cargo:rerun-if-changed=gen_rust.py");
+    println!("cargo:rerun-if-env-changed=OPENCV_HEADER_DEFINES");
+    println!("cargo:rerun-if-env-changed=OPENCV_HEADER_DOCS");
+    println!("cargo:rerun-if-env-changed=OPENCV_HEADER_PROFILE");
 
     let out_dir = PathBuf::from(std::env::var("OUT_DIR").unwrap());
     let out_dir_as_str = out_dir.to_str().unwrap();
@@ -189,9 +192,16 @@ fn build_wrapper(opencv: pkg_config::Library) {
         write!(&mut types, "#include <cstddef>\n").unwrap();
     }
 
+    // modules are generated in parallel, each generator can parse its headers using the cores left
+    let parse_jobs = std::env::var("OPENCV_HEADER_PARSE_JOBS").unwrap_or_else(|_| {
+        let num_jobs = std::env::var("NUM_JOBS").ok().and_then(|x| x.parse::<usize>().ok()).unwrap_or(1);
+        (num_jobs / modules.len().max(1)).max(1).to_string()
+    });
+
     modules.par_iter_mut().for_each(|module| {
         if !Command::new("python3")
             .args(&["gen_rust.py", "hdr_parser.py", out_dir_as_str, out_dir_as_str, &module.0])
+            .env("OPENCV_HEADER_PARSE_JOBS", &parse_jobs)
             .args(
                 &(module
                     .1
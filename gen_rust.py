@@ -1,3 +1,4 @@
+import json
 import logging
 import os.path
 import re
@@ -43,23 +44,6 @@ def combine_dicts(src, add):
     return out
 
 
-def classes_equal(first, second):
-    """
-    :type first: str
-    :type second: str
-    :rtype: bool
-    """
-    first = first.strip()
-    second = second.strip()
-    if first == second:
-        return True
-    if not first.startswith("::") and second.endswith("::" + first):
-        return True
-    if not second.startswith("::") and first.endswith("::" + second):
-        return True
-    return False
-
-
 def write_exc(filename, action):
     """ Calls action with file handle of filename only when file didn't exist before, thread-safe """
     try:
@@ -76,7 +60,7 @@ def write_exc(filename, action):
 
 # dict of decls to inject before doing header parsing
 # key: module name
-# value: list of declarations as supplied by hdr_parser
+# value: list of declarations in the list form of hdr_parser.Decl
 decls_manual_pre = {
     "core": [
         ("class cv.Range", "", ["/Ghost"], []),
@@ -94,7 +78,7 @@ decls_manual_pre = {
 
 # dict of decls to inject after doing header parsing
 # key: module name
-# value: list of declarations as supplied by hdr_parser
+# value: list of declarations in the list form of hdr_parser.Decl
 decls_manual_post = {
     "core": [
         ("cv.Mat.size", "Size", ["/C"], []),
@@ -610,14 +594,14 @@ static_modules = ("core", "sys", "types")
 def decl_patch(module, decl):
     if module == "objdetect":
         # replace Mat with explicit vector because detect functions only accept vector InputArray
-        if decl[0] == "cv.QRCodeDetector.detect" or decl[0] == "cv.QRCodeDetector.detectAndDecode":
-            pts_arg = decl[3][1]
-            if pts_arg[0] == "OutputArray" and pts_arg[1] == "points":
-                decl[3][1][0] = "std::vector<Point>&"
-        elif decl[0] == "cv.QRCodeDetector.decode" or decl[0] == "cv.decodeQRCode":
-            pts_arg = decl[3][1]
-            if pts_arg[0] == "InputArray" and pts_arg[1] == "points":
-                decl[3][1][0] = "const std::vector<Point>&"
+        if decl.name == "cv.QRCodeDetector.detect" or decl.name == "cv.QRCodeDetector.detectAndDecode":
+            pts_arg = decl.args[1]
+            if pts_arg.type == "OutputArray" and pts_arg.name == "points":
+                pts_arg.type = "std::vector<Point>&"
+        elif decl.name == "cv.QRCodeDetector.decode" or decl.name == "cv.decodeQRCode":
+            pts_arg = decl.args[1]
+            if pts_arg.type == "InputArray" and pts_arg.name == "points":
+                pts_arg.type = "const std::vector<Point>&"
     return decl
 
 
@@ -698,20 +682,54 @@ def bump_counter(name):
     return "{}{}".format(base_name, counter + 1)
 
 
+class NamespaceResolver(object):
+    """
+    Splits the qualified names into the longest known namespace and the local part. The namespaces are hashed, so a
+    split is a lookup per "::" of the name instead of a scan over all the namespaces, and the splits are memoized
+    """
+
+    def __init__(self, namespaces):
+        """
+        :type namespaces: iterable
+        """
+        self.namespaces = frozenset(namespaces)
+        self.splits = {}
+
+    def __repr__(self):
+        return repr(self.namespaces)
+
+    def __iter__(self):
+        return iter(self.namespaces)
+
+    def split(self, name):
+        """
+        :type name: str
+        :rtype: (str, str)
+        """
+        out = self.splits.get(name)
+        if out is None:
+            out = ("", name)
+            pos = name.rfind("::")
+            while pos >= 0:
+                if name[:pos] in self.namespaces:
+                    out = (name[:pos], name[pos+2:])
+                    break
+                pos = name.rfind("::", 0, pos + 1)
+            self.splits[name] = out
+        return out
+
+
 def split_known_namespace(name, namespaces):
     """
     :type name: str
-    :type namespaces: iterable
+    :type namespaces: NamespaceResolver|iterable
     :rtype: (str, str)
     """
-    if "::" in name:
-        for namespace in sorted(namespaces, key=len, reverse=True):
-            namespace_colon = namespace + "::"
-            if name.startswith(namespace_colon):
-                return namespace, name[len(namespace_colon):]
-        return "", name
-    else:
+    if "::" not in name:
         return "", name
+    if not isinstance(namespaces, NamespaceResolver):
+        namespaces = NamespaceResolver(namespaces)
+    return namespaces.split(name)
 
 #
 #       AST-LIKE
@@ -723,7 +741,7 @@ class GeneralInfo:
         """
         :type gen: RustWrapperGenerator
         :type name: str
-        :type namespaces: frozenset
+        :type namespaces: NamespaceResolver
         """
         self.gen = gen
         self.fullname, self.namespace, self.classpath, self.classname, self.name = self.do_parse_name(name, namespaces)
@@ -758,25 +776,24 @@ class GeneralInfo:
 
 
 class ArgInfo:
-    def __init__(self, gen, arg_tuple):  # [ ctype, name, def val, [mod], argno ]
+    def __init__(self, gen, arg):
         """
         :type gen: RustWrapperGenerator
-        :param arg_tuple:
+        :type arg: hdr_parser.Arg
         """
         self.gen = gen
-        typ = arg_tuple[0]
-        self.type = self.gen.get_type_info(typ)
-        self.name = arg_tuple[1]
+        typ = arg.type
+        self.type = self.gen.get_type_info(arg.type_node)
+        self.name = arg.name
         if not self.name:
             self.name = "unnamed_arg"
         self.rsname = camel_case_to_snake_case(reserved_rename.get(self.name, self.name))
-        self.defval = ""
-        if len(arg_tuple) > 2:
-            self.defval = arg_tuple[2]
+        self.defval = arg.defval
         self.out = ""
-        if typ in ("OutputArray", "OutputArrayOfArrays") or len(arg_tuple) > 3 and "/O" in arg_tuple[3] or self.type.is_by_ref and not self.type.is_const:
+        mods = arg.mods
+        if typ in ("OutputArray", "OutputArrayOfArrays") or mods & ModBit.O or self.type.is_by_ref and not self.type.is_const:
             self.out = "O"
-        if typ in ("InputOutputArray", "InputOutputArrayOfArrays") or len(arg_tuple) > 3 and "/IO" in arg_tuple[3]:
+        if typ in ("InputOutputArray", "InputOutputArrayOfArrays") or mods & ModBit.IO:
             self.out = "IO"
 
     def is_output(self):
@@ -839,14 +856,14 @@ class FuncInfo(GeneralInfo):
          """),
     }
 
-    def __init__(self, gen, module, decl, namespaces=frozenset()):  # [ funcname, return_ctype, [modifiers], [args] ]
+    def __init__(self, gen, module, decl, namespaces=frozenset()):
         """
         :type gen: RustWrapperGenerator
         :type module: str
-        :type decl: list
-        :type namespaces: frozenset
+        :type decl: hdr_parser.Decl
+        :type namespaces: NamespaceResolver
         """
-        GeneralInfo.__init__(self, gen, decl[0], namespaces)
+        GeneralInfo.__init__(self, gen, decl.name, namespaces)
         self.module = module
 
         self.is_ignored = False
@@ -857,7 +874,7 @@ class FuncInfo(GeneralInfo):
                     self.is_ignored = True
                 else:
                     raise NameError("class not found: " + self.classname)
-            if "/A" in decl[2]:
+            if decl.mods & ModBit.A:
                 self.ci.is_trait = True
             if self.classname == self.name:
                 self.kind = self.KIND_CONSTRUCTOR
@@ -865,22 +882,23 @@ class FuncInfo(GeneralInfo):
                 self.type = gen.get_type_info(self.classname)
             else:
                 self.kind = self.KIND_METHOD
-                self.type = gen.get_type_info(decl[1])
+                self.type = gen.get_type_info(decl.rettype_node)
         else:
             self.kind = self.KIND_FUNCTION
             self.ci = None  # type: ClassInfo
-            self.type = gen.get_type_info(decl[1])
+            self.type = gen.get_type_info(decl.rettype_node)
 
         self.identifier = self.fullname.replace("::", "_")
 
-        self.is_ignored = self.is_ignored or "/H" in decl[2] or "/I" in decl[2]
+        mods = decl.mods
+        self.is_ignored = self.is_ignored or bool(mods & (ModBit.H | ModBit.I))
 
-        self.is_const = "/C" in decl[2]
-        self.is_static = "/S" in decl[2]
+        self.is_const = bool(mods & ModBit.C)
+        self.is_static = bool(mods & ModBit.S)
         self.attr_accessor_type = None
-        if "/ATTRGETTER" in decl[2]:
+        if mods & ModBit.ATTRGETTER:
             self.attr_accessor_type = "r"
-        elif "/ATTRSETTER" in decl[2]:
+        elif mods & ModBit.ATTRSETTER:
             self.attr_accessor_type = "w"
         self.has_callback_arg = False
         has_userdata_arg = False
@@ -889,7 +907,7 @@ class FuncInfo(GeneralInfo):
             self.identifier += "_const"
 
         self.args = []
-        for arg in decl[3]:
+        for arg in decl.args:
             ai = ArgInfo(gen, arg)
             if self.has_callback_arg and ai.name == "userdata":
                 has_userdata_arg = True
@@ -900,15 +918,13 @@ class FuncInfo(GeneralInfo):
             self.identifier += "_" + ai.type.rust_safe_id
             if isinstance(ai.type, CallbackTypeInfo):
                 self.has_callback_arg = True
+        self.signature = (self.fullname, tuple((ai.type.typeid, ai.name, ai.defval) for ai in self.args))
 
         if self.has_callback_arg and not has_userdata_arg:
             logging.info("ignore function with callback, but without userdata %s %s in %s"%(self.kind, self.name, self.ci))
             self.is_ignored = True
 
-        if len(decl) > 5:
-            self.comment = decl[5]
-        else:
-            self.comment = ""
+        self.comment = decl.docstring
 
         self.cname = self.cppname = self.name
         self.is_safe = self.identifier not in func_unsafe_list
@@ -981,6 +997,14 @@ class FuncInfo(GeneralInfo):
 
         return None
 
+    def signature_key(self):
+        """
+        Canonical key of the signature (the full name and the type, name and default value of every argument), the
+        functions with the same key are generated only once
+        :rtype: (str, tuple)
+        """
+        return self.signature
+
     def r_name(self):
         name = func_rename.get(self.identifier)
         if name is None:
@@ -1179,44 +1203,45 @@ class FuncInfo(GeneralInfo):
 
 
 class ClassPropInfo:
-    def __init__(self, decl):  # [f_ctype, f_name, '', '/RW']
-        self.is_const = "/C" in decl[3]
-        self.ctype = "{}{}".format("const " if self.is_const else "", decl[0])
-        self.name = decl[1]
-        self.comment = decl[2]
-        self.rw = "/RW" in decl[3]
+    def __init__(self, prop):
+        """
+        :type prop: hdr_parser.Prop
+        """
+        self.is_const = bool(prop.mods & ModBit.C)
+        self.ctype = "{}{}".format("const " if self.is_const else "", prop.type)
+        self.name = prop.name
+        self.comment = prop.docstring
+        self.rw = bool(prop.mods & ModBit.RW)
 
     def __repr__(self):
         return template("PROP $ctype $name").substitute(ctype=self.ctype, name=self.name)
 
 
 class ClassInfo(GeneralInfo):
-    def __init__(self, gen, module, decl, namespaces):  # [ 'class/struct cname', ': base', [modlist] ]
+    def __init__(self, gen, module, decl, namespaces):
         """
         :type gen: RustWrapperGenerator
         :type module: str
-        :type decl: list
-        :type namespaces: frozenset
+        :type decl: hdr_parser.Decl
+        :type namespaces: NamespaceResolver
         """
-        GeneralInfo.__init__(self, gen, decl[0], namespaces)
+        GeneralInfo.__init__(self, gen, decl.name, namespaces)
         self.methods = []  # type: list[FuncInfo]
         self.namespaces = namespaces
         self.module = module
         self.is_simple = self.is_ignored = self.is_ghost = self.is_callback = False
         self.is_trait = self.fullname in forced_class_trait
         self.classname = self.name
-        self.comment = ""
-        if len(decl) > 5:
-            self.comment = decl[5]
-        for m in decl[2]:
-            if (m == "/Simple" or m == "/Map") and self.fullname not in force_class_not_simple:
-                self.is_simple = True
-            if m == "/Hidden":
-                self.is_ignored = True
-            if m == "/Ghost":
-                self.is_ghost = True
-            if m == "/Callback":
-                self.is_callback = True
+        self.comment = decl.docstring
+        mods = decl.mods
+        if mods & (ModBit.Simple | ModBit.Map) and self.fullname not in force_class_not_simple:
+            self.is_simple = True
+        if mods & ModBit.Hidden:
+            self.is_ignored = True
+        if mods & ModBit.Ghost:
+            self.is_ghost = True
+        if mods & ModBit.Callback:
+            self.is_callback = True
         if self.classpath:
             ci = self.gen.get_class(self.classpath)
             if ci is not None and ci.is_ignored:
@@ -1224,7 +1249,7 @@ class ClassInfo(GeneralInfo):
 
         self.nested_cname = self.fullname.replace("::", "_")
 
-        bases = decl[1][1:].strip()
+        bases = decl.rettype[1:].strip()  # ": base1, base2"
         if len(bases):
             self.bases = [x for x in set(x.strip() for x in bases.split(",")) if x != self.fullname]
         else:
@@ -1237,7 +1262,7 @@ class ClassInfo(GeneralInfo):
 
         # class props
         self.props = []
-        for p in decl[3]:
+        for p in decl.args:
             self.props.append(ClassPropInfo(p))
 
         self.is_ignored = self.is_ignored or self.gen.class_is_ignored(self.fullname)
@@ -1294,14 +1319,14 @@ class ConstInfo(GeneralInfo):
     def __init__(self, gen, decl, namespaces):
         """
         :type gen: RustWrapperGenerator
-        :type decl: list
-        :type namespaces: frozenset
+        :type decl: hdr_parser.Decl
+        :type namespaces: NamespaceResolver
         """
-        GeneralInfo.__init__(self, gen, decl[0], namespaces)
+        GeneralInfo.__init__(self, gen, decl.name, namespaces)
         _, self.rustname = split_known_namespace(self.fullname, namespaces)
         self.rustname = self.rustname.replace("::", "_")
         self.cname = self.name.replace(".", "::")
-        self.value = decl[1]
+        self.value = decl.rettype
 
     def __repr__(self):
         return template("CONST $name=$value").substitute(name=self.name, value=self.value)
@@ -1353,14 +1378,12 @@ class TypedefInfo(GeneralInfo):
     def __init__(self, gen, decl, namespaces):
         """
         :type gen: RustWrapperGenerator
-        :type decl: list
-        :type namespaces: frozenset
+        :type decl: hdr_parser.Decl
+        :type namespaces: NamespaceResolver
         """
-        GeneralInfo.__init__(self, gen, decl[0], namespaces)
-        self.alias = decl[1]
-        self.comment = ""
-        if len(decl) > 5:
-            self.comment = decl[5]
+        GeneralInfo.__init__(self, gen, decl.name, namespaces)
+        self.alias = decl.rettype
+        self.comment = decl.docstring
 
     def typ(self):
         return self.gen.get_type_info(self.name)
@@ -1381,13 +1404,13 @@ class CallbackInfo(GeneralInfo):
     def __init__(self, gen, decl, namespaces):
         """
         :type gen: RustWrapperGenerator
-        :type decl: list
-        :type namespaces: frozenset
+        :type decl: hdr_parser.Decl
+        :type namespaces: NamespaceResolver
         """
-        GeneralInfo.__init__(self, gen, decl[0], namespaces)
+        GeneralInfo.__init__(self, gen, decl.name, namespaces)
         self.args = []
         self.is_ignored = False
-        for arg in decl[3]:
+        for arg in decl.args:
             ai = ArgInfo(gen, arg)
             while any(True for x in self.args if x.name == ai.name):
                 ai.name = bump_counter(ai.name)
@@ -1396,10 +1419,7 @@ class CallbackInfo(GeneralInfo):
                 self.is_ignored = True
             self.args.append(ai)
 
-        if len(decl) > 5:
-            self.comment = decl[5]
-        else:
-            self.comment = ""
+        self.comment = decl.docstring
 
     def gen_rust(self):
         args = []
@@ -1440,7 +1460,7 @@ class TypeInfo(object):
         self.cpptype = self.typeid
         self.c_safe_id = "XX"  # c safe type identifier used for file names and return wrappers
 
-        _, self.rust_local = split_known_namespace(self.typeid, gen.namespaces)
+        _, self.rust_local = split_known_namespace(self.typeid, gen.namespace_resolver())
         self.rust_local = self.rust_local.replace("::", "_")  # only the type name for Rust without module path
         self.rust_safe_id = self.rust_local  # rust safe type identifier used for file and function names
         self.rust_full = ""  # full module path (with modules/crate::) to Rust type
@@ -2294,49 +2314,32 @@ class UnknownTypeInfo(TypeInfo):
         return "Unknown[%s]" % (self.typeid)
 
 
-def parse_type(gen, typeid):
+def parse_type(gen, node):
     """
     :type gen: RustWrapperGenerator
-    :type typeid: str
+    :type node: hdr_parser.TypeNode
     :rtype: TypeInfo
     """
-    typeid = typeid.strip()
-    full_typeid = typeid
-    is_const = False
-    if full_typeid.startswith("const "):
-        typeid = full_typeid[6:]
-        is_const = True
-    if typeid == "":
-        typeid = "void"
-        full_typeid = "void"
-    # if typeid.endswith("&"):
-    #     return ReferenceTypeInfo(gen, typeid, gen.get_type_info(typeid[0:-1]))
-    is_by_ref = False
-    if typeid.endswith("&"):
-        typeid = typeid[:-1].strip()
-        is_by_ref = True
+    if node.spelling == "":
+        node = hdr_parser.TypeNode.get("void")
+    full_typeid = node.spelling
+    is_const = node.const
+    is_by_ref = node.ref
+    typeid = node.core
     if typeid in primitives:
         return PrimitiveTypeInfo(gen, full_typeid)
-    elif typeid.endswith("*"):
-        return RawPtrTypeInfo(gen, full_typeid, gen.get_type_info(typeid[:-1].strip()))
-    elif typeid.endswith("[]"):
-        return RawPtrTypeInfo(gen, full_typeid, gen.get_type_info(typeid[:-2].strip()))
+    elif node.kind == "pointer" or node.kind == "array":
+        return RawPtrTypeInfo(gen, full_typeid, gen.get_type_info(node.target))
     elif typeid in ("string", "String", "std::string", "cv::String"):
         return StringTypeInfo(gen, full_typeid)
     elif typeid == "":
         raise NameError("empty type detected")
-    elif typeid.startswith("Ptr<"):
-        return SmartPtrTypeInfo(gen, full_typeid, gen.get_type_info(typeid[4:-1].strip()))
-    #        return RawPtrTypeInfo(gen, full_typeid, gen.get_type_info(typeid[4:-1]))
-    elif typeid.startswith("vector<"):
-        inner = gen.get_type_info(typeid[7:-1].strip())
+    elif node.template == "Ptr":
+        return SmartPtrTypeInfo(gen, full_typeid, gen.get_type_info(node.inner))
+    elif node.template in ("vector", "std::vector"):
+        inner = gen.get_type_info(node.inner)
         if not inner:
-            raise NameError("inner type `%s' not found" % (typeid[7:-1].strip()))
-        return VectorTypeInfo(gen, full_typeid, inner)
-    elif typeid.startswith("std::vector<"):
-        inner = gen.get_type_info(typeid[12:-1].strip())
-        if not inner:
-            raise NameError("inner type `%s' not found" % (typeid[12:-1].strip()))
+            raise NameError("inner type `%s' not found" % (node.inner.spelling,))
         return VectorTypeInfo(gen, full_typeid, inner)
     else:
         ci = gen.get_class(typeid)
@@ -2359,9 +2362,114 @@ def parse_type(gen, typeid):
                     return CallbackTypeInfo(gen, reconst_full_typeid)
                 else:
                     return BoxedClassTypeInfo(gen, reconst_full_typeid)
-            return parse_type(gen, actual)
+            return parse_type(gen, hdr_parser.TypeNode.get(actual))
     return UnknownTypeInfo(gen, full_typeid)
 
+class DocRenderer(object):
+    """
+    Renders the Doxygen comments as rustdoc. The rules are compiled once and applied in order, a rule runs only when
+    its trigger (the literal text any of its matches contains) is in the comment. The rendered comments are memoized
+    by their text, the overloads and the properties often share them
+    """
+
+    # (<trigger>, <compiled pattern or None to replace the trigger>, <replacement>, <count>)
+    TITLE_RULES = [
+        ("@{", re.compile(r"\s*@{.*$", re.M), "", 0),
+        ("@}", re.compile(r"\s*@}.*$", re.M), "", 0),
+        ("@defgroup", re.compile(r"@defgroup [^ ]+ (.*)"), "# \\1", 0),
+        ("@addtogroup", re.compile(r"^.*?@addtogroup\s+(.+)", re.M), "", 0),
+    ]
+
+    BODY_RULES = [
+        # remove asterisks from c++ comment delimiters
+        ("*", re.compile(r"^\s*\*$", re.M), "", 0),
+        ("* ", re.compile(r"^\* ", re.M), "", 0),
+        # comment body markers
+        ("@brief", None, "", 0),
+        ("@note", None, "\nNote:", 0),
+        # code blocks, don't run them during tests
+        ("@code", None, "```ignore", 0),
+        ("@endcode", None, "```\n", 0),
+        # see also block
+        ("@sa", re.compile(r"@sa\s+", re.M), "## See also\n", 1),
+        ("@sa", None, "", 0),
+        # citation links
+        ("@cite", re.compile(r"@cite\s+(.+?)\b"), r"[\1](https://docs.opencv.org/3.4.6/d0/de3/citelist.html#CITEREF_\1)", 0),
+        # images
+        ("![", re.compile(r"!\[(.*?)\]\((?:pics/)?(.+)?\)"), r"![\1](https://docs.opencv.org/3.4.6/\2)", 0),
+        # ?
+        ("*****", re.compile(r".*\*\*\*\*\*", re.M), "", 0),
+        # returns
+        ("@return", re.compile(r"^.*?@returns?\s*", re.M), "## Returns\n", 0),
+        # parameter list
+        ("@param", re.compile(r"^(.*?@param)", re.M), "## Parameters\n\\1", 1),
+        ("@param", re.compile(r"^.*?@param(?:\[in\])?\s+(\w+) *(.*)", re.M), r"* \1: \2", 0),
+        ("@param", re.compile(r"^.*?@param\s*\[out\]\s+(\w+) *(.*)", re.M), r"* \1: [out] \2", 0),
+    ]
+
+    DEPRECATED_RE = re.compile(r"^.*?@deprecated\s+(.+)", re.M)
+
+    TAIL_RULES = [
+        # ?
+        ("-  ", re.compile("^-  (.*)", re.M), "*  \\1", 0),
+        # math expressions
+        # if r"\f" in text:
+        #     text = '<script type="text/javascript" src="https://latex.codecogs.com/latexit.js"></script>\n' + text  # fixme, slows down browser a lot
+        ("\\f[", re.compile(r"\\f\[", re.M), "<div lang='latex'>", 0),
+        ("\\f]", re.compile(r"\\f\]", re.M), "</div>", 0),
+        ("\\f$", re.compile(r"\\f\$(.*?)\\f\$", re.M), "<span lang='latex'>\\1</span>", 0),
+        # catch sequences of 4 indents and reduce them to avoid cargo test running them as code
+        ("", re.compile(r"^((\s{1,5})\2{3})(\S)", re.M), r"\2\3", 0),
+    ]
+
+    LINE_START_RE = re.compile("^", re.M)
+
+    def __init__(self):
+        self.rendered = {}
+
+    @staticmethod
+    def apply(rules, text):
+        for trigger, pattern, repl, count in rules:
+            if trigger in text:
+                if pattern is None:
+                    text = text.replace(trigger, repl)
+                else:
+                    text = pattern.sub(repl, text, count)
+        return text
+
+    def render(self, text, comment_prefix="///"):
+        """
+        :type text: str
+        :type comment_prefix: str
+        :rtype: str
+        """
+        key = (text, comment_prefix)
+        out = self.rendered.get(key)
+        if out is None:
+            out = self.rendered[key] = self.do_render(text, comment_prefix)
+        return out
+
+    def do_render(self, text, comment_prefix):
+        # module titles
+        text = self.apply(self.TITLE_RULES, text).strip()
+        if len(text) == 0:
+            return ""
+        text = self.apply(self.BODY_RULES, text)
+        # deprecated
+        deprecated = None
+        if "@deprecated" in text:
+            m = self.DEPRECATED_RE.search(text)
+            if m is not None:
+                text = self.DEPRECATED_RE.sub(r"**Deprecated**: \1\n", text)
+                deprecated = m.group(1)
+        text = self.apply(self.TAIL_RULES, text).strip()
+        if len(text) > 0:
+            # add rustdoc comment markers
+            text = self.LINE_START_RE.sub(comment_prefix + " ", text) + "\n"
+        if deprecated is not None:
+            text += "#[deprecated = \"{}\"]\n".format(deprecated)
+        return text
+
 #
 #       GENERATOR
 #
@@ -2409,16 +2517,27 @@ class RustWrapperGenerator(object):
         self.cpp_dir = ""
         self.rust_dir = ""
         self.classes = OrderedDict()  # type: dict[str, ClassInfo]
+        self.class_symbols = hdr_parser.SymbolTable()
         self.functions = []
+        # {<fullname>: <the comment of the first registered function with it that is not an @overload>}
+        self.primary_docs = {}  # type: dict[str, str]
+        self.doc_renderer = DocRenderer()
         self.ported_func_list = []
         self.skipped_func_list = []
         self.consts = []
-        self.type_infos = {}
+        # {<ConstInfo.cname>: <the first registered ConstInfo with it>}
+        self.const_index = {}  # type: dict[str, ConstInfo]
+        self.type_infos = {}  # type: dict[hdr_parser.TypeNode, TypeInfo]
         self.callbacks = []  # type: list[CallbackInfo]
+        self.callback_index = {}  # type: dict[str, CallbackInfo]
         self.namespaces = set()
+        self._namespace_resolver = None
+        self._resolved_namespaces = None
         self.generated = set()
-        self.generated_functions = []
+        self.generated_signatures = set()
         self.func_names = set()
+        # {<the name that was taken>: <the last name it was bumped to>}, the renaming resumes from there
+        self.func_name_bumps = {}
 
     def get_class(self, classname):
         """
@@ -2428,52 +2547,62 @@ class RustWrapperGenerator(object):
         c = self.classes.get(classname)
         if c:
             return c
-        for c in self.classes.values():
-            if classes_equal(classname, c.fullname):
-                return c
-        return None
+        fullname = self.class_symbols.find(classname)
+        if fullname is None:
+            return None
+        return self.classes[fullname]
+
+    def namespace_resolver(self):
+        """
+        Returns the resolver of the current namespaces, it's rebuilt only after the namespaces change (they're only
+        ever added to, so the size tells)
+        :rtype: NamespaceResolver
+        """
+        resolver = self._namespace_resolver
+        if resolver is None or self._resolved_namespaces is not self.namespaces or \
+                len(resolver.namespaces) != len(self.namespaces):
+            resolver = self._namespace_resolver = NamespaceResolver(self.namespaces)
+            self._resolved_namespaces = self.namespaces
+        return resolver
 
     def set_type_info(self, typeid, type_info):
-        typeid = typeid.strip()
-        self.type_infos[typeid] = type_info
+        self.type_infos[hdr_parser.TypeNode.get(typeid)] = type_info
 
     def get_type_info(self, typeid):
         """
-        :type typeid: str
+        :type typeid: str|hdr_parser.TypeNode
         :rtype: TypeInfo
         """
-        typeid = typeid.strip()
-        if typeid not in self.type_infos:
-            self.type_infos[typeid] = parse_type(self, typeid)
-        return self.type_infos[typeid]
+        node = typeid if isinstance(typeid, hdr_parser.TypeNode) else hdr_parser.TypeNode.get(typeid)
+        type_info = self.type_infos.get(node)
+        if type_info is None:
+            type_info = self.type_infos[node] = parse_type(self, node)
+        return type_info
 
     def get_const(self, name):
         """
         :type name: str
         :rtype: ConstInfo
         """
-        for c in self.consts:
-            if c.cname == name:
-                return c
-        return None
+        return self.const_index.get(name)
 
     def get_callback(self, name):
         """
         :type name: str
         :rtype: CallbackInfo
         """
-        for x in self.callbacks:
-            if x.fullname == name:
-                return x
-        return None
+        return self.callback_index.get(name)
 
     def add_decl(self, module, decl):
+        if not isinstance(decl, hdr_parser.Decl):
+            # manual declarations are given as tuples
+            decl = hdr_parser.Decl.from_list(decl)
         decl = decl_patch(module, decl)
-        if decl[0] == "cv.String.String" or decl[0] == 'cv.Exception.~Exception':
+        if decl.name == "cv.String.String" or decl.name == 'cv.Exception.~Exception':
             return
-        if decl[0] == "cv.Algorithm":
-            decl[0] = "cv.Algorithm.Algorithm"
-        name = decl[0]  # type: str
+        if decl.name == "cv.Algorithm":
+            decl.name = "cv.Algorithm.Algorithm"
+        name = decl.name  # type: str
         if name.startswith("struct") or name.startswith("class"):
             self.add_class_decl(module, decl)
         elif name.startswith("const"):
@@ -2486,34 +2615,37 @@ class RustWrapperGenerator(object):
             self.add_func_decl(module, decl)
 
     def add_class_decl(self, module, decl):
-        item = ClassInfo(self, module, decl, frozenset(self.namespaces))
+        item = ClassInfo(self, module, decl, self.namespace_resolver())
         # register
         logging.info("register class %s (%s)%s%s", item.fullname, decl,
                      " [ignored]" if item.is_ignored else "",
                      " impl:"+",".join(item.bases) if len(item.bases) else "")
         self.classes[item.fullname] = item
+        self.class_symbols.add(item.fullname, "class", item.bases)
 
     def add_const_decl(self, _module, decl):
-        item = ConstInfo(self, decl, frozenset(self.namespaces))
+        item = ConstInfo(self, decl, self.namespace_resolver())
         # register
         if item.is_ignored():
             logging.info('ignored: %s', item)
         elif not self.get_const(item.name):
             self.consts.append(item)
+            self.const_index.setdefault(item.cname, item)
 
     def add_typedef_decl(self, _module, decl):
-        item = TypedefInfo(self, decl, frozenset(self.namespaces))
+        item = TypedefInfo(self, decl, self.namespace_resolver())
         if not isinstance(item.alias_typ(), UnknownTypeInfo) and isinstance(item.typ(), UnknownTypeInfo):
             self.set_type_info(item.name, item.alias_typ())
 
     def add_callback_decl(self, module, decl):
-        item = CallbackInfo(self, decl, frozenset(self.namespaces))
+        item = CallbackInfo(self, decl, self.namespace_resolver())
         if not item.is_ignored:
-            self.add_decl(module, ("class {}".format(item.fullname.replace("::", ".")), "", ["/Ghost", "/Callback"], []))
+            self.add_decl(module, hdr_parser.Decl("class {}".format(item.fullname.replace("::", ".")), "", ModBit.Ghost | ModBit.Callback))
             self.callbacks.append(item)
+            self.callback_index.setdefault(item.fullname, item)
 
     def add_func_decl(self, module, decl):
-        item = FuncInfo(self, module, decl, frozenset(self.namespaces))
+        item = FuncInfo(self, module, decl, self.namespace_resolver())
         if not item.is_ignored:
             # register self to class or generator
             if item.kind == item.KIND_FUNCTION:
@@ -2524,6 +2656,8 @@ class RustWrapperGenerator(object):
     def register_function(self, f):
         logging.info("register %s %s (%s)"%(f.kind, f.name, f.identifier))
         self.functions.append(f)
+        if len(f.comment) > 0 and "@overload" not in f.comment:
+            self.primary_docs.setdefault(f.fullname, f.comment)
 
     def gen(self, srcfiles, module, cpp_dir, rust_dir):
         """
@@ -2537,7 +2671,27 @@ class RustWrapperGenerator(object):
         self.rust_dir = rust_dir
         includes = []
 
-        parser = hdr_parser.CppHeaderParser()
+        # parse results are cached between the runs, OUT_DIR subdirectories are kept by build.rs
+        # OPENCV_HEADER_CACHE_DIR set to an empty string disables the cache
+        cache = None
+        cache_dir = os.environ.get("OPENCV_HEADER_CACHE_DIR", os.path.join(cpp_dir, "hdr_parser_cache"))
+        if cache_dir:
+            cache_size = int(os.environ.get("OPENCV_HEADER_CACHE_SIZE_MB", "32")) * 1024 * 1024
+            cache = hdr_parser.ParseCache(cache_dir, cache_size)
+        # preprocessor conditionals are evaluated with the modules of the OpenCV build (opencv_modules.hpp next to
+        # the module header) and the macros from OPENCV_HEADER_DEFINES in the form "NAME NAME=VALUE !NAME ..."
+        modules_header = os.path.join(os.path.dirname(srcfiles[0]), "opencv_modules.hpp") if srcfiles else ""
+        if os.path.isfile(modules_header):
+            macros = hdr_parser.MacroEnv.from_header(modules_header, ("HAVE_OPENCV_",))
+        else:
+            macros = hdr_parser.MacroEnv()
+        macros.update(os.environ.get("OPENCV_HEADER_DEFINES", ""))
+        # OPENCV_HEADER_DOCS=0 skips the doc comments, the generated code has no documentation then
+        docs = os.environ.get("OPENCV_HEADER_DOCS", "1") != "0"
+        # the statements with errors are skipped, so all the errors of the module are reported at once
+        # OPENCV_HEADER_PROFILE=1 writes the parse times and statistics to <module>.parse_profile.json next to the log
+        profile = os.environ.get("OPENCV_HEADER_PROFILE", "0") != "0"
+        parser = hdr_parser.CppHeaderParser(cache=cache, macros=macros, docs=docs, recover=True, profile=profile)
         self.namespaces = set(x for x in parser.namespaces)
         self.namespaces.add("cv")
 
@@ -2546,16 +2700,53 @@ class RustWrapperGenerator(object):
                 logging.info("\n--- Manual ---\n%s", pformat(decl, 4))
                 self.add_decl(m, decl)
 
-        for hdr in srcfiles:
-            decls = parser.parse(hdr, False)
-            self.namespaces = set(str(x.replace(".", "::")) for x in parser.namespaces)
+        # headers are parsed in OPENCV_HEADER_PARSE_JOBS worker processes, build.rs sets it to the number of
+        # the cores that are not busy with the other modules
+        jobs = int(os.environ.get("OPENCV_HEADER_PARSE_JOBS", "1"))
+        # the declarations are compared with the previous run of the module, the fingerprints are kept with the cache
+        fingerprints = None
+        if cache_dir:
+            fingerprints = hdr_parser.FingerprintIndex(os.path.join(cache_dir, "{}.fingerprints.json".format(module)))
+        # the namespaces are indexed by the parser as the events pass through
+        self.namespaces = parser.symbols.namespaces
+        failed = False
+        for hdr, events in parser.parse_headers(srcfiles, False, jobs, fingerprints):
             logging.info("\n\n=============== Header: %s ================\n\n", hdr)
+            includes.append('#include "' + hdr + '"')
+            for kind, value in events:
+                if kind == "diagnostic":
+                    # the declarations following the skipped statements can be broken and fail the generator before
+                    # the errors are reported, so after an error the headers are only parsed to report all the errors
+                    failed = True
+                elif failed:
+                    continue
+                if kind == "decl":
+                    logging.info("\n--- Incoming ---\n%s", pformat(value, 4))
+                    self.add_decl(module, value)
+                elif kind == "namespace":
+                    logging.info("Namespace: %s", value)
             logging.info("Namespaces: %s", parser.namespaces)
             logging.info("Comment: %s", parser.module_comment)
-            includes.append('#include "' + hdr + '"')
-            for decl in decls:
-                logging.info("\n--- Incoming ---\n%s", pformat(decl, 4))
-                self.add_decl(module, decl)
+        if profile:
+            logging.info("Parser stats: %s, memo cache hit rates: %s", dict(parser.stats), parser.hit_rates())
+            with open("{}/{}.parse_profile.json".format(cpp_dir, module), "w") as f:
+                json.dump(parser.profile_report(), f, indent=1)
+        if parser.diagnostics:
+            for e in parser.diagnostics:
+                logging.error("%s", e)
+            sys.exit(-1)
+        if fingerprints is not None:
+            fingerprints.save()
+            for hdr, changes in fingerprints.changes.items():
+                if changes.new:
+                    logging.info("New header %s (%s)", hdr, fingerprints.fingerprint[hdr])
+                elif changes:
+                    logging.info("Changed header %s, %s", hdr, changes)
+            # the symbol table of the module is kept along with the fingerprints
+            try:
+                parser.symbols.save(os.path.join(cache_dir, "{}.symbols.json".format(module)))
+            except (IOError, OSError):
+                pass
 
         for m, decls in decls_manual_post.items():
             for decl in decls:
@@ -2670,11 +2861,10 @@ class RustWrapperGenerator(object):
         :return:
         """
         if fi.kind == fi.KIND_FUNCTION or fi.attr_accessor_type:
-            for item in self.generated_functions:
-                if item.fullname == fi.fullname and str(item.args) == str(fi.args):
-                    return
-            else:
-                self.generated_functions.append(fi)
+            signature = fi.signature_key()
+            if signature in self.generated_signatures:
+                return
+            self.generated_signatures.add(signature)
         logging.info("Generating func %s"%(fi.identifier))
         reason = fi.reason_to_skip()
         if reason:
@@ -2697,11 +2887,13 @@ class RustWrapperGenerator(object):
         # If duplicate functions have the same call arguments, we skip duplicate function.
         rust_func_name = fi.r_name()
         classname = "" if fi.kind == fi.KIND_FUNCTION else fi.classname
-        renamed = False
-        while classname + '::' + rust_func_name in self.func_names:
-            rust_func_name = bump_counter(rust_func_name)
-            renamed = True
-        if renamed:
+        taken = classname + '::' + rust_func_name
+        if taken in self.func_names:
+            # the names in func_names are never removed, so the ones bumped past before are still taken
+            rust_func_name = self.func_name_bumps.get(taken, rust_func_name)
+            while classname + '::' + rust_func_name in self.func_names:
+                rust_func_name = bump_counter(rust_func_name)
+            self.func_name_bumps[taken] = rust_func_name
             func_rename[fi.identifier] = rust_func_name
 
         # rust safe wrapper
@@ -2871,41 +3063,41 @@ class RustWrapperGenerator(object):
                 self.gen_func(fi)
             if isinstance(t, BoxedClassTypeInfo):
                 for prop in ci.props:
-                    attrs = ["/ATTRGETTER"]
+                    attrs = ModBit.ATTRGETTER
                     prop_type = self.get_type_info(prop.ctype)
                     is_const = prop_type.is_const or prop_type.is_copy
                     if is_const:
-                        attrs.append("/C")
+                        attrs |= ModBit.C
                     read_func = FuncInfo(
                         self,
                         ci.module,
-                        [
+                        hdr_parser.Decl(
                             "{}.{}".format(ci.fullname, prop.name),
                             prop.ctype,
                             attrs,
                             [],
                             None,
                             prop.comment
-                        ],
-                        self.namespaces)
+                        ),
+                        self.namespace_resolver())
                     if not read_func.is_ignored and not read_func.rv_type().is_ignored:
                         self.gen_func(read_func)
                         if not is_const:
-                            attrs = ["/ATTRSETTER"]
+                            attrs = ModBit.ATTRSETTER
                             write_func = FuncInfo(
                                 self,
                                 ci.module,
-                                [
+                                hdr_parser.Decl(
                                     "{}.set_{}".format(ci.fullname, prop.name),
                                     "void",
                                     attrs,
-                                    (
-                                        [prop_type.cpptype, "val", "", []],
-                                    ),
+                                    [
+                                        hdr_parser.Arg(prop_type.cpptype, "val"),
+                                    ],
                                     None,
                                     prop.comment
-                                ],
-                                self.namespaces
+                                ),
+                                self.namespace_resolver()
                             )
                             self.gen_func(write_func)
             if has_impl:
@@ -2920,64 +3112,12 @@ class RustWrapperGenerator(object):
         """
         # @overload
         if func_info is not None and "@overload" in text:
-            try:
-                src_comment = next(x.comment for x in self.functions if x.fullname == func_info.fullname and "@overload" not in x.comment and len(x.comment) > 0)
+            src_comment = self.primary_docs.get(func_info.fullname)
+            if src_comment is not None:
                 text = text.replace("@overload", src_comment + "\n\n## Overloaded parameters\n")
-            except StopIteration:
+            else:
                 text = text.replace("@overload", "")
-        # module titles
-        text = re.sub(r"\s*@{.*$", "", text, 0, re.M)
-        text = re.sub(r"\s*@}.*$", "", text, 0, re.M)
-        text = re.sub(r"@defgroup [^ ]+ (.*)", "# \\1", text)
-        text = re.sub(r"^.*?@addtogroup\s+(.+)", "", text, 0, re.M)
-        text = text.strip()
-        if len(text) == 0:
-            return ""
-        # remove asterisks from c++ comment delimiters
-        text = re.sub(r"^\s*\*$", "", text, 0, re.M)
-        text = re.sub(r"^\* ", "", text, 0, re.M)
-        # comment body markers
-        text = text.replace("@brief", "").replace("@note", "\nNote:")
-        # code blocks, don't run them during tests
-        text = text.replace("@code", "```ignore").replace("@endcode", "```\n")
-        # see also block
-        text = re.sub(r"@sa\s+", "## See also\n", text, 1, re.M)
-        text = text.replace("@sa", "")
-        # citation links
-        text = re.sub(r"@cite\s+(.+?)\b", r"[\1](https://docs.opencv.org/3.4.6/d0/de3/citelist.html#CITEREF_\1)", text)
-        # images
-        text = re.sub(r"!\[(.*?)\]\((?:pics/)?(.+)?\)", r"![\1](https://docs.opencv.org/3.4.6/\2)", text)
-        # ?
-        text = re.sub(r".*\*\*\*\*\*", "", text, 0, re.M)
-        # returns
-        text = re.sub(r"^.*?@returns?\s*", "## Returns\n", text, 0, re.M)
-        # parameter list
-        text = re.sub(r"^(.*?@param)", "## Parameters\n\\1", text, 1, re.M)
-        text = re.sub(r"^.*?@param(?:\[in\])?\s+(\w+) *(.*)", r"* \1: \2", text, 0, re.M)
-        text = re.sub(r"^.*?@param\s*\[out\]\s+(\w+) *(.*)", r"* \1: [out] \2", text, 0, re.M)
-        # deprecated
-        m = re.search(r"^.*?@deprecated\s+(.+)", text, re.M)
-        deprecated = None
-        if m is not None:
-            text = re.sub(r"^.*?@deprecated\s+(.+)", r"**Deprecated**: \1\n", text, 0, re.M)
-            deprecated = m.group(1)
-        # ?
-        text = re.sub("^-  (.*)", "*  \\1", text, 0, re.M)
-        # math expressions
-        # if r"\f" in text:
-        #     text = '<script type="text/javascript" src="https://latex.codecogs.com/latexit.js"></script>\n' + text  # fixme, slows down browser a lot
-        text = re.sub(r"\\f\[", "<div lang='latex'>", text, 0, re.M)
-        text = re.sub(r"\\f\]", "</div>", text, 0, re.M)
-        text = re.sub(r"\\f\$(.*?)\\f\$", "<span lang='latex'>\\1</span>", text, 0, re.M)
-        # catch sequences of 4 indents and reduce them to avoid cargo test running them as code
-        text = re.sub(r"^((\s{1,5})\2{3})(\S)", r"\2\3", text, 0, re.M)
-        text = text.strip()
-        if len(text) > 0:
-            # add rustdoc comment markers
-            text = re.sub("^", comment_prefix + " ", text.strip(), 0, re.M) + "\n"
-        if deprecated is not None:
-            text += "#[deprecated = \"{}\"]\n".format(deprecated)
-        return text
+        return self.doc_renderer.render(text, comment_prefix)
 
 
 def main():
@@ -3007,4 +3147,5 @@ if __name__ == "__main__":
         hdr_parser_path = os.path.dirname(hdr_parser_path)
     sys.path.append(hdr_parser_path)
     import hdr_parser
+    from hdr_parser import ModBit
     main()
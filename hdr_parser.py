@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 
+import enum
+import hashlib
 import io
+import json
+import os
+import pickle
 import re
 import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # the list only for debugging. The real list, used in the real OpenCV build, is specified in CMakeLists.txt
 opencv_hdr_list = [
@@ -25,16 +35,1177 @@ opencv_hdr_list = [
 Each declaration is [funcname, return_value_type /* in C, not in Python */, <list_of_modifiers>, <list_of_arguments>, original_return_type, docstring],
 where each element of <list_of_arguments> is 4-element list itself:
 [argtype, argname, default_value /* or "" if none */, <list_of_modifiers>]
-where the list of modifiers is yet another nested list of strings
-   (currently recognized are "/O" for output argument, "/S" for static (i.e. class) methods
-   and "/A value" for the plain C arrays with counters)
+where the modifiers are the Mod flags stored as an int (see ModBit)
+   (e.g. Mod.O for output argument, Mod.S for static (i.e. class) methods), the modifiers carrying a value
+   ("/A value" for the plain C arrays with counters, "/CA value" for the custom arrays and "=alias" for the
+   exported names) are stored in the separate fields of the records
 original_return_type is None if the original_return_type is the same as return_value_type
+
+The declarations and arguments are the Decl and Arg records (class properties are Prop records), which can still be
+used as the lists described above. The `modlist` property of the records gives the modifiers in the original list
+of strings form.
+"""
+
+
+class Mod(enum.IntFlag):
+    """
+    Modifiers of the declarations, arguments and class properties, the names match the list of strings form
+    ("/O" is Mod.O and so on)
+    """
+    # arguments
+    O = enum.auto()  # output argument
+    IO = enum.auto()  # input-output argument
+    Ref = enum.auto()  # passed by reference
+    # arguments, properties and methods
+    C = enum.auto()  # const
+    # properties
+    RW = enum.auto()  # writable property
+    # functions and methods
+    S = enum.auto()  # static method
+    V = enum.auto()  # virtual method
+    PV = enum.auto()  # pure virtual method
+    A = enum.auto()  # abstract method (non-wrap mode)
+    E = enum.auto()  # explicit constructor
+    I = enum.auto()  # inline constructor implementation
+    H = enum.auto()  # non-public method
+    NW = enum.auto()  # non-wrap mode declaration
+    # classes
+    Map = enum.auto()
+    Simple = enum.auto()
+    Hidden = enum.auto()  # non-public class
+    # added by the generator
+    Ghost = enum.auto()
+    Callback = enum.auto()
+    ATTRGETTER = enum.auto()
+    ATTRSETTER = enum.auto()
+
+
+class ModBit(object):
+    """
+    The Mod flags as plain ints. The records store the modifiers as ints and the parser and the generator test and
+    combine them with these: the operators of Mod run the enum code in Python and are an order of magnitude slower
+    than the int ones. Mod itself is only used to name the bits
+    """
+    O = Mod.O.value
+    IO = Mod.IO.value
+    Ref = Mod.Ref.value
+    C = Mod.C.value
+    RW = Mod.RW.value
+    S = Mod.S.value
+    V = Mod.V.value
+    PV = Mod.PV.value
+    A = Mod.A.value
+    E = Mod.E.value
+    I = Mod.I.value
+    H = Mod.H.value
+    NW = Mod.NW.value
+    Map = Mod.Map.value
+    Simple = Mod.Simple.value
+    Hidden = Mod.Hidden.value
+    Ghost = Mod.Ghost.value
+    Callback = Mod.Callback.value
+    ATTRGETTER = Mod.ATTRGETTER.value
+    ATTRSETTER = Mod.ATTRSETTER.value
+
+
+NO_MODS = 0
+
+# prefixes of the modifiers carrying a value in the list of strings form and the record fields they are stored in
+valued_modifiers = (("/A ", "array"), ("/CA ", "custom_array"), ("=", "alias"))
+
+
+def parse_modlist(modlist):
+    """
+    Converts the modifiers from the list of strings form (a single string is accepted too)
+    Returns mods, values where values is the dict of the record fields for the modifiers carrying a value
+    """
+    if isinstance(modlist, str):
+        modlist = [modlist] if modlist else []
+    mods = 0
+    values = {}
+    for m in modlist:
+        for prefix, field in valued_modifiers:
+            if m.startswith(prefix):
+                values[field] = m[len(prefix):]
+                break
+        else:
+            mods |= Mod[m[1:]].value
+    return mods, values
+
+
+def format_modlist(record):
+    """
+    Returns the modifiers of the record in the list of strings form
+    """
+    modlist = ["/" + m.name for m in Mod if m.value & record.mods]
+    for prefix, field in valued_modifiers:
+        value = getattr(record, field, None)
+        if value is not None:
+            modlist.append(prefix + value)
+    return modlist
+
+
+class Record(object):
+    """
+    Compact record with the fields stored in __slots__. It also behaves as the list of the values of its `fields`
+    (indexing, len, iteration and comparison with lists), the way the parser results were represented before
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [getattr(self, f) for f in self.fields[index]]
+        return getattr(self, self.fields[index])
+
+    def __setitem__(self, index, value):
+        setattr(self, self.fields[index], value)
+
+    def __iter__(self):
+        for f in self.fields:
+            yield getattr(self, f)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            repr(Mod(getattr(self, f)) if f == "mods" else getattr(self, f)) for f in self.__slots__))
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, f) for f in self.__slots__)
+
+    @property
+    def modlist(self):
+        return format_modlist(self)
+
+    def copy(self):
+        return type(self)(*[getattr(self, f) for f in self.__slots__])
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        Creates the record from the list form with the modifiers as the list of strings
+        """
+        values = list(values)
+        mods_index = cls.fields.index("mods")
+        values[mods_index], extra = parse_modlist(values[mods_index])
+        return cls(*values, **extra)
+
+    def to_list(self):
+        """
+        Returns the list form of the record with the modifiers as the list of strings, the inverse of from_list
+        """
+        values = []
+        for field in self.fields:
+            value = getattr(self, field)
+            if field == "mods":
+                value = self.modlist
+            elif isinstance(value, list):
+                value = [x.to_list() if isinstance(x, Record) else x for x in value]
+            values.append(value)
+        return values
+
+    def fingerprint(self):
+        """
+        Returns the hash of the record content, which is the same for the equal records in any run of the parser
+        """
+        return hashlib.sha1(repr(self.to_list()).encode("utf-8")).hexdigest()[:16]
+
+
+class DocString(object):
+    """
+    Docstring recorded as the positions of the doc comments in the header source (see HeaderSource) and converted
+    to the text only when it's asked for with str(). `ops` is the sequence of ("block", start, end) for the content
+    of a /** */ comment, which replaces the text collected so far, ("line", start, end) for the content of a //!
+    comment, which is appended as a line, and ("strip", 0, 0). The source must be alive until the text is
+    requested. The text is only deferred in the serial parsing without the parse cache: pickling (the cache entries
+    and the results of the worker processes) stores the text, and so does the repr. gen_rust.py reads every docstring
+    (the debug dump of the declarations), so there the saving is the work of the scanner, not the conversion
+    """
+    __slots__ = ("source", "ops")
+
+    def __init__(self, source, ops):
+        self.source = source
+        self.ops = ops
+
+    def __str__(self):
+        text, decode = self.source.text, self.source.decode
+        doc = ""
+        for op, start, end in self.ops:
+            if op == "line":
+                doc += decode(text[start:end]).strip() + "\n"
+            elif op == "block":
+                lines = decode(text[start:end]).split("\n")
+                if len(lines) == 1:
+                    doc = lines[0]
+                else:
+                    lines = [lines[0].rstrip()] + [l.strip() for l in lines[1:-1]] + [lines[-1].lstrip()]
+                    doc = "\n".join(lines) + "\n"
+            else:
+                doc = doc.strip()
+        return doc
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __reduce__(self):
+        return str, (str(self),)
+
+
+def intern_str(s):
+    return sys.intern(s) if type(s) is str else s
+
+
+template_name_re = re.compile(r"[A-Za-z_][\w:]*(?=<)")
+
+
+def split_template_args(text):
+    """
+    Splits the template argument list at the top level commas
+    """
+    args = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(text):
+        if c in "<(":
+            depth += 1
+        elif c in ">)":
+            depth -= 1
+        elif c == "," and depth == 0:
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return args
+
+
+class TypeNode(object):
+    """
+    C++ type as spelled in the declarations, parsed into the nodes from the outermost layer down. The nodes are
+    hash-consed: there is only one node for every (stripped) spelling, so they are compared and hashed by identity
+    and can be used as dictionary keys. Use TypeNode.get() to obtain the nodes.
+    `const` and `ref` are the leading "const " and the trailing "&", `core` is the type without them,
+    `kind` is the kind of the core: "pointer" or "array" with the `target` node, "template" with the `template`
+    name, the node of the whole argument list `inner` and the nodes of the single arguments `args`, or "name"
+    """
+    __slots__ = ("spelling", "const", "ref", "core", "kind", "target", "template", "inner", "args")
+    nodes = {}
+
+    @classmethod
+    def get(cls, spelling):
+        spelling = spelling.strip()
+        node = cls.nodes.get(spelling)
+        if node is None:
+            node = cls.nodes[spelling] = cls(spelling)
+        return node
+
+    def __init__(self, spelling):
+        self.spelling = spelling
+        self.const = spelling.startswith("const ")
+        core = spelling[6:] if self.const else spelling
+        self.ref = core.endswith("&")
+        if self.ref:
+            core = core[:-1].strip()
+        self.core = core
+        self.target = self.template = self.inner = None
+        self.args = ()
+        if core.endswith("*"):
+            self.kind = "pointer"
+            self.target = TypeNode.get(core[:-1])
+        elif core.endswith("[]"):
+            self.kind = "array"
+            self.target = TypeNode.get(core[:-2])
+        else:
+            m = template_name_re.match(core)
+            if m:
+                self.kind = "template"
+                self.template = m.group()
+                self.inner = TypeNode.get(core[m.end()+1:-1])
+                self.args = tuple(TypeNode.get(x) for x in split_template_args(self.inner.spelling))
+            else:
+                self.kind = "name"
+
+    def __repr__(self):
+        return "TypeNode({!r})".format(self.spelling)
+
+
+class DocumentedRecord(Record):
+    """
+    Record with the `docstring` field, which can be set to a DocString and reads as str
+    """
+    __slots__ = ()
+
+    @property
+    def docstring(self):
+        doc = self._docstring
+        if type(doc) is not str:
+            doc = self._docstring = str(doc)
+        return doc
+
+    @docstring.setter
+    def docstring(self, value):
+        self._docstring = value
+
+
+class Decl(DocumentedRecord):
+    """
+    Declaration: function or method, class, constant, typedef or callback, see above.
+    For the classes `rettype` is the list of bases (": base1, base2") and `args` are the class properties,
+    for the constants it's the value and for the typedefs it's the aliased type.
+    `alias` is the exported name ("=alias" modifier) or None.
+    `umat_args` are the (<index>, <declared type>, <declared default value>) of the wrapped function arguments that
+    depend on the matrix type (see CppHeaderParser.array_arg) or None
+    """
+    __slots__ = ("name", "rettype", "mods", "args", "original_type", "_docstring", "alias", "umat_args")
+    fields = ("name", "rettype", "mods", "args", "original_type", "docstring")
+
+    def __init__(self, name, rettype="", mods=NO_MODS, args=None, original_type=None, docstring="", alias=None,
+                 umat_args=None):
+        self.name = intern_str(name)
+        self.rettype = intern_str(rettype)
+        self.mods = mods
+        self.args = [] if args is None else args
+        self.original_type = original_type
+        self.docstring = docstring
+        self.alias = alias
+        self.umat_args = umat_args
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        Creates the declaration from the list form (with the modifiers as the list of strings), converting the
+        arguments (or class properties) as well
+        """
+        decl = super(Decl, cls).from_list(values)
+        item_cls = Prop if decl.name.startswith(("class ", "struct ")) else Arg
+        decl.args = [x if isinstance(x, Record) else item_cls.from_list(x) for x in decl.args]
+        return decl
+
+    def copy(self):
+        """
+        Returns the copy of the declaration with the copies of the arguments, so it can be modified independently
+        """
+        return Decl(self.name, self.rettype, self.mods, [x.copy() for x in self.args], self.original_type,
+                    self._docstring, self.alias, self.umat_args)
+
+    @property
+    def rettype_node(self):
+        return TypeNode.get(self.rettype)
+
+    @property
+    def key(self):
+        """
+        Identifies the declaration in the header: the name, with the argument types for the functions to tell
+        the overloads apart
+        """
+        if self.name.startswith(("class ", "struct ", "const ", "typedef ", "callback ")):
+            return self.name
+        return "{}({})".format(self.name, ", ".join(a.type for a in self.args))
+
+
+class Arg(Record):
+    """
+    Function argument: [argtype, argname, default_value, <modifiers>],
+    `array` and `custom_array` are the counters of the plain C arrays ("/A value" and "/CA value" modifiers) or None
+    """
+    __slots__ = ("type", "name", "defval", "mods", "array", "custom_array")
+    fields = __slots__[:4]
+
+    def __init__(self, type, name="", defval="", mods=NO_MODS, array=None, custom_array=None):
+        self.type = intern_str(type)
+        self.name = intern_str(name)
+        self.defval = defval
+        self.mods = mods
+        self.array = array
+        self.custom_array = custom_array
+
+    def copy(self):
+        return Arg(self.type, self.name, self.defval, self.mods, self.array, self.custom_array)
+
+    @property
+    def type_node(self):
+        return TypeNode.get(self.type)
+
+
+class Prop(DocumentedRecord):
+    """
+    Class property: [type, name, docstring, <modifiers>], `array` and `custom_array` are the same as in Arg
+    """
+    __slots__ = ("type", "name", "_docstring", "mods", "array", "custom_array")
+    fields = ("type", "name", "docstring", "mods")
+
+    def __init__(self, type, name, docstring="", mods=NO_MODS, array=None, custom_array=None):
+        self.type = intern_str(type)
+        self.name = intern_str(name)
+        self.docstring = docstring
+        self.mods = mods
+        self.array = array
+        self.custom_array = custom_array
+
+# tokens of the header source: preprocessor directives (with continuation lines), ignored CV__ lines, comments,
+# string literals and statement terminators, everything else is the statement text between the tokens.
+# Every alternative starts with a literal character, which lets the regex engine skip the plain text quickly;
+# that's why the line-based tokens include the preceding newline, the first line is matched separately
+line_start_token_pattern = r"""
+    (?P<directive> [^\S\n]*\#(?:[^\n]*\\[^\S\n]*\n)*[^\n]* )
+  | (?P<ignored> [^\S\n]*CV__[^\n]* )
+"""
+header_token_pattern = r"""
+    \n(?P<directive> [^\S\n]*\#(?:[^\n]*\\[^\S\n]*\n)*[^\n]* )
+  | \n(?P<ignored> [^\S\n]*CV__[^\n]* )
+  | /(?P<comment> \*.*?(?:\*/|\Z) )
+  | /(?P<line_comment> /[^\n]* )
+  | "(?P<string> (?:[^"\\\n]|\\[^\n])*" )
+  | "(?P<bad_string>)
+  | ;(?P<semicolon>)
+  | \{(?P<block_begin>)
+  | \}(?P<block_end>;?)
+"""
+# the source can be either str or a bytes-like buffer, the patterns are compiled for both
+header_token_re = {
+    str: (re.compile(line_start_token_pattern, re.X), re.compile(header_token_pattern, re.S | re.X)),
+    bytes: (re.compile(line_start_token_pattern.encode(), re.X), re.compile(header_token_pattern.encode(), re.S | re.X)),
+}
+
+# tokens of the bodies of the blocks that are not processed (function bodies, private sections, ...), used to find
+# the end of the block without splitting it into statements. Comments and string literals are matched the same way
+# as in header_token_pattern, the tokens that need the full parser (directives, ignored lines, doc comments,
+# bad strings and Objective C statements) are the stops
+block_skip_pattern = r"""
+    \n(?P<stop> [^\S\n]*(?:\#|CV__) )
+  | /(?P<doc_comment> \*\*|/! )
+  | /(?P<comment> \*.*?(?:\*/|\Z) )
+  | /(?P<line_comment> /[^\n]* )
+  | "(?P<string> (?:[^"\\\n]|\\[^\n])*" )
+  | (?P<bad_string> ["@] )
+  | ;(?P<semicolon>)
+  | \{(?P<block_begin>)
+  | \}(?P<block_end>;?)
 """
+block_skip_re = {
+    str: re.compile(block_skip_pattern, re.S | re.X),
+    bytes: re.compile(block_skip_pattern.encode(), re.S | re.X),
+}
+
+# words that make a statement with parentheses worth parsing in the wrap mode: the export markers, the statements
+# other than the function declarations and the access labels. The function declarations without them are never
+# exported, so such statements are rejected before they are normalized and parsed. The non-wrap mode declares every
+# function, exported or not, so there's no such filter there and gen_rust.py, which parses in the non-wrap mode,
+# doesn't benefit from this one: it only speeds up the wrap-mode callers
+export_marker_pattern = r"CV_EXPORTS_W|CV_EXPORTS_AS|CV_WRAP|CV_PROP|typedef|class|struct|enum|namespace|extern|" \
+                        r"public|protected|private|@"
+export_marker_re = {
+    str: re.compile(export_marker_pattern),
+    bytes: re.compile(export_marker_pattern.encode()),
+}
+
+# delimiters used to split macro calls, argument lists and argument types
+macro_paren_re = re.compile(r"[()]")
+arg_list_delim_re = re.compile(r"[(),<>]")
+arg_type_delim_re = re.compile(r"[ &*<>,]")
+
+# preprocessor conditional directives, used to find the end of an inactive region without tokenizing it
+conditional_directive_pattern = r"\n[^\S\n]*\#[^\S\n]*(?:(?P<open>if|ifdef|ifndef)|(?P<close>endif)|(?P<branch>elif|else))\b"
+conditional_directive_re = {
+    str: re.compile(conditional_directive_pattern),
+    bytes: re.compile(conditional_directive_pattern.encode()),
+}
+
+
+class HeaderSource(object):
+    """
+    The header text: a str, or a bytes-like buffer (bytes, mmap) with UTF-8 content, which is never copied as a whole.
+    The parser works with the offsets in the buffer, the pieces it needs are sliced and converted with `decode`,
+    the other attributes are the separators of the matching type
+    """
+
+    def __init__(self, text):
+        self.text = text
+        if isinstance(text, str):
+            self.decode = str
+            self.newline, self.space = "\n", " "
+            self.line_comment_doc, self.comment_doc, self.comment_end, self.ignored = "//!", "/**", "*/", "CV__"
+            self.defgroup = "@defgroup"
+            self.first_token_re, self.token_re = header_token_re[str]
+            self.conditional_re = conditional_directive_re[str]
+            self.block_skip_re = block_skip_re[str]
+            self.export_marker_re, self.paren = export_marker_re[str], "("
+        else:
+            self.decode = bytes.decode
+            self.newline, self.space = b"\n", b" "
+            self.line_comment_doc, self.comment_doc, self.comment_end, self.ignored = b"//!", b"/**", b"*/", b"CV__"
+            self.defgroup = b"@defgroup"
+            self.first_token_re, self.token_re = header_token_re[bytes]
+            self.conditional_re = conditional_directive_re[bytes]
+            self.block_skip_re = block_skip_re[bytes]
+            self.export_marker_re, self.paren = export_marker_re[bytes], b"("
+
+    def lineno(self, pos):
+        """
+        Returns the number of the line containing the offset `pos`
+        """
+        return self.text[:pos].count(self.newline) + 1
+
+
+class HeaderLexer(object):
+    """
+    Splits the whole header into tokens in a single pass with the compiled header_token_re.
+    Iterating over the lexer yields (kind, start, end) tuples, where kind is the name of the matched group
+    and the positions are the offsets in the source buffer.
+    The consumer may move `pos` forward while iterating to skip a part of the text.
+    """
+
+    def __init__(self, source):
+        """
+        :type source: HeaderSource
+        """
+        self.source = source
+        self.pos = 0
+
+    def __iter__(self):
+        source = self.source
+        text = source.text
+        search = source.token_re.search
+        newline, ignored = source.newline, source.ignored
+        m = source.first_token_re.match(text)
+        while 1:
+            if m is None:
+                m = search(text, self.pos)
+                if m is None:
+                    return
+            kind = m.lastgroup
+            start, end = m.span()
+            m = None
+            if kind == "comment" and text[end:end+4] == ignored and text.find(newline, start, end) >= 0:
+                # the rest of the line after a multi-line comment is ignored just like CV__ lines
+                end = text.find(newline, end)
+                if end < 0:
+                    end = len(text)
+            self.pos = end
+            yield kind, start, end
+
+
+class ParseCache(object):
+    """
+    Persistent cache of the parse results, stored as one file per parsed header in `cache_dir`.
+    The entries are addressed by the hash of the header name and content, the source of this parser and the parse
+    flags, so they never go stale: a changed header or parser simply maps to a new entry. When the total size of the
+    entries exceeds `max_size` bytes the least recently used ones are removed.
+    """
+
+    MAGIC = b"HDRP\x01"
+    SUFFIX = ".hdrp"
+
+    def __init__(self, cache_dir, max_size=32*1024*1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.parser_hash = parser_source_hash()
+
+    def key(self, hname, content, flags):
+        """
+        :param hname: name of the header, the diagnostics refer to it, so the headers with the same content don't
+            share the entries
+        :type content: bytes
+        :param flags: tuple of parse options that affect the result
+        :rtype: str
+        """
+        h = hashlib.sha1(self.parser_hash.encode())
+        h.update(repr((hname, flags)).encode())
+        h.update(content)
+        return h.hexdigest()
+
+    def load(self, key):
+        """
+        Returns the list of cached parser events or None if there is no valid entry for the key
+        """
+        path = os.path.join(self.cache_dir, key + self.SUFFIX)
+        try:
+            with io.open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None) # mark as recently used
+        except (IOError, OSError):
+            return None
+        if not data.startswith(self.MAGIC):
+            return None
+        events = []
+        try:
+            unpickler = pickle.Unpickler(io.BytesIO(zlib.decompress(data[len(self.MAGIC):])))
+            while 1:
+                events.append(unpickler.load())
+        except EOFError:
+            return events
+        except Exception:
+            return None
+
+    def record(self, key, events):
+        """
+        Passes the parser events through and stores them when the stream is over.
+        The events are serialized as they go, before the consumer gets a chance to modify them
+        """
+        buf = io.BytesIO()
+        pickler = pickle.Pickler(buf, 4)
+        for event in events:
+            pickler.dump(event)
+            yield event
+        self.store(key, buf.getvalue())
+
+    def store(self, key, data):
+        data = self.MAGIC + zlib.compress(data)
+        if len(data) > self.max_size:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # several generators can share the cache, so the entry appears atomically
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key + self.SUFFIX))
+        except (IOError, OSError):
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.SUFFIX):
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name, st.st_size))
+                total_size += st.st_size
+        entries.sort()
+        for _, name, size in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total_size -= size
+
+
+class SymbolTable(object):
+    """
+    Index of the symbols by their qualified C++ names ("cv::ml::SVM"): `symbols` maps the name to (<kind>, <info>),
+    `namespaces` is the set of the namespace names. The parser fills it with the namespaces, the classes and structs
+    (<info> is the list of the bases), the typedefs and callbacks (<info> is the aliased or the return type) and the
+    constants of the enums and defines (<info> is the value). The names are resolved with hashed lookups of the
+    names and their "::" suffixes, see find()
+    """
+
+    def __init__(self):
+        self.namespaces = set()
+        self.symbols = OrderedDict()
+        self.order = {}
+        # {<the part of the name after any "::">: [<names>]}
+        self.suffixes = {}
+
+    def add(self, name, kind, info=None):
+        """
+        Adds the symbol or replaces the info of the existing one, which keeps its place in the order of the symbols
+        """
+        name = name.strip()
+        if name not in self.symbols:
+            self.order[name] = len(self.order)
+            pos = name.find("::")
+            while pos >= 0:
+                self.suffixes.setdefault(name[pos+2:], []).append(name)
+                pos = name.find("::", pos+1)
+        self.symbols[name] = (kind, info)
+        if kind == "namespace":
+            self.namespaces.add(name)
+
+    def add_decl(self, decl):
+        """
+        Adds the symbol declared by the parser declaration, the functions are not indexed
+        """
+        kind, _, name = decl.name.partition(" ")
+        if not name or kind not in ("class", "struct", "typedef", "callback", "const"):
+            return
+        name = name.replace(".", "::")
+        if kind == "class" or kind == "struct":
+            bases = decl.rettype[1:].split(",") if decl.rettype.startswith(":") else []
+            self.add(name, kind, [b.strip() for b in bases])
+        else:
+            self.add(name, kind, decl.rettype)
+
+    def find(self, name, kinds=None):
+        """
+        Returns the qualified name of the first added symbol (of one of the `kinds`) that is `name`, ends with
+        "::<name>" or is the end of `name` after "::", or None. A name starting with "::" is only looked up as is
+        """
+        name = name.strip()
+        candidates = []
+        if name in self.symbols:
+            candidates.append(name)
+        if not name.startswith("::"):
+            candidates.extend(self.suffixes.get(name, ()))
+        pos = name.find("::")
+        while pos >= 0:
+            suffix = name[pos+2:]
+            if suffix in self.symbols and not suffix.startswith("::"):
+                candidates.append(suffix)
+            pos = name.find("::", pos+1)
+        if kinds is not None:
+            candidates = [x for x in candidates if self.symbols[x][0] in kinds]
+        if not candidates:
+            return None
+        return min(candidates, key=self.order.__getitem__)
+
+    def save(self, path):
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "namespaces": sorted(self.namespaces),
+                "symbols": [[name, kind, info] for name, (kind, info) in self.symbols.items()],
+            }, indent=1))
+
+    @classmethod
+    def load(cls, path):
+        with io.open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        table = cls()
+        for name, kind, info in data["symbols"]:
+            table.add(name, kind, info)
+        table.namespaces.update(data["namespaces"])
+        return table
+
+
+class HeaderChanges(object):
+    """
+    The keys (see Decl.key) of the declarations of a header that were added, removed or changed since the previous
+    run, `new` is True for the header that wasn't parsed before
+    """
+
+    def __init__(self, added=(), removed=(), changed=(), new=False):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.changed = list(changed)
+        self.new = new
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return "added: {}; removed: {}; changed: {}".format(
+            ", ".join(self.added) or "-", ", ".join(self.removed) or "-", ", ".join(self.changed) or "-")
+
+
+class FingerprintIndex(object):
+    """
+    Fingerprints of the declarations and of the whole parsed headers, kept in the JSON file `path` between the runs.
+    The parser events of a header passed through track() are compared with the previous run, the differences are
+    collected in `changes` ({<header>: HeaderChanges}) and `fingerprint` has the header fingerprints of this run
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with io.open(path, encoding="utf-8") as f:
+                self.headers = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.headers = {}
+        self.tracked = {}
+        self.fingerprint = OrderedDict()
+        self.changes = OrderedDict()
+
+    def track(self, hname, events):
+        """
+        Passes the parser events of the header through, the changes are known when the stream is over
+        """
+        decls = OrderedDict()
+        h = hashlib.sha1()
+        for kind, value in events:
+            if kind == "decl":
+                fingerprint = value.fingerprint()
+                key = base_key = value.key
+                n = 1
+                while key in decls:
+                    n += 1
+                    key = "{}#{}".format(base_key, n)
+                decls[key] = fingerprint
+                h.update(fingerprint.encode())
+            else:
+                h.update(repr((kind, value)).encode("utf-8"))
+            yield kind, value
+        self.fingerprint[hname] = h.hexdigest()[:16]
+        self.tracked[hname] = {"fingerprint": self.fingerprint[hname], "decls": decls}
+        old = self.headers.get(hname)
+        if old is None:
+            self.changes[hname] = HeaderChanges(added=decls, new=True)
+        elif old["fingerprint"] == self.fingerprint[hname]:
+            self.changes[hname] = HeaderChanges()
+        else:
+            old_decls = old["decls"]
+            self.changes[hname] = HeaderChanges(
+                [key for key in decls if key not in old_decls],
+                [key for key in old_decls if key not in decls],
+                [key for key, fingerprint in decls.items() if old_decls.get(key, fingerprint) != fingerprint],
+            )
+
+    def save(self):
+        """
+        Stores the fingerprints of the headers tracked in this run, the headers of the previous run that were not
+        tracked are reported as removed
+        """
+        for hname, old in self.headers.items():
+            if hname not in self.tracked:
+                self.changes[hname] = HeaderChanges(removed=old["decls"])
+        self.headers = self.tracked
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname or ".", suffix=".tmp")
+            with io.open(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self.headers, indent=1))
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+
+class MemoCache(object):
+    """
+    Bounded in-memory cache of the results of the parser methods, the least recently used entries are evicted
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.seen = set()
+
+    def admit(self, key):
+        """
+        Returns True if the key was offered before: storing the results that are expensive to copy only pays off
+        for the repeated keys, most of the keys are never repeated
+        """
+        if key in self.seen:
+            return True
+        if len(self.seen) >= self.max_size * 8:
+            self.seen.clear()
+        self.seen.add(key)
+        return False
+
+    def get(self, key, default=None):
+        value = self.entries.get(key, default)
+        if value is not default:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+_parser_source_hash = None
+
+def parser_source_hash():
+    """
+    Hash of the source of this module, entries cached by the previous versions of the parser must not be used
+    """
+    global _parser_source_hash
+    if _parser_source_hash is None:
+        with io.open(os.path.abspath(__file__), "rb") as f:
+            _parser_source_hash = hashlib.sha1(f.read()).hexdigest()
+    return _parser_source_hash
+
+
+# tokens of the preprocessor condition expressions
+condition_token_re = re.compile(r"\s*(?:(\d\w*)|(\w+)|(&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^?:(),]))")
+
+# binary operators of the preprocessor conditions with their precedence
+condition_binary_operators = {
+    "||": 1, "&&": 2, "|": 3, "^": 4, "&": 5, "==": 6, "!=": 6, "<": 7, ">": 7, "<=": 7, ">=": 7,
+    "<<": 8, ">>": 8, "+": 9, "-": 9, "*": 10, "/": 10, "%": 10,
+}
+
+
+def c_division(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+condition_operator_funcs = {
+    "|": lambda a, b: a | b,
+    "^": lambda a, b: a ^ b,
+    "&": lambda a, b: a & b,
+    "==": lambda a, b: int(a == b),
+    "!=": lambda a, b: int(a != b),
+    "<": lambda a, b: int(a < b),
+    ">": lambda a, b: int(a > b),
+    "<=": lambda a, b: int(a <= b),
+    ">=": lambda a, b: int(a >= b),
+    "<<": lambda a, b: a << b if b >= 0 else None,
+    ">>": lambda a, b: a >> b if b >= 0 else None,
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: c_division(a, b) if b else None,
+    "%": lambda a, b: a - b * c_division(a, b) if b else None,
+}
+
+
+class MacroEnv(object):
+    """
+    Macro environment for the evaluation of the preprocessor conditionals.
+    `defines` maps the names of the defined macros to their values, `undefines` are the names of the macros known to be
+    undefined, as well as all the macros with the names starting with one of `known_prefixes` that are not defined
+    (e.g. "HAVE_OPENCV_" with the defines from opencv_modules.hpp). The other macros are unknown, the conditions
+    depending on them evaluate to None and both branches of such conditionals are parsed.
+    """
+
+    def __init__(self, defines=None, undefines=(), known_prefixes=()):
+        self.defines = dict(defines or {})
+        self.undefines = set(undefines)
+        self.known_prefixes = tuple(known_prefixes)
+
+    @classmethod
+    def from_header(cls, path, known_prefixes=()):
+        """
+        Creates the environment with the macros #defined in the header `path` (e.g. opencv_modules.hpp)
+        """
+        defines = {}
+        with io.open(path, "rt", encoding="utf-8") as f:
+            for l in f:
+                define = re.match(r"\s*#\s*define\s+(\w+)(?:\s+(.*?))?\s*$", l)
+                if define:
+                    defines[define.group(1)] = define.group(2) or ""
+        return cls(defines, (), known_prefixes)
+
+    def update(self, spec):
+        """
+        Adds the macros from the string in the form "NAME NAME=VALUE !NAME ..." (separated by spaces or commas),
+        where !NAME marks the macro as undefined
+        """
+        for item in re.split(r"[\s,]+", spec.strip()):
+            if not item:
+                continue
+            if item.startswith("!"):
+                self.defines.pop(item[1:], None)
+                self.undefines.add(item[1:])
+            else:
+                name, _, value = item.partition("=")
+                self.undefines.discard(name)
+                self.defines[name] = value or "1"
+
+    def key(self):
+        """
+        Returns the representation of the environment for the cache keys
+        """
+        return sorted(self.defines.items()), sorted(self.undefines), self.known_prefixes
+
+    def is_defined(self, name):
+        """
+        Returns True if the macro is defined, False if it's known to be undefined and None if it's unknown
+        """
+        if name in self.defines:
+            return True
+        if name in self.undefines or name.startswith(self.known_prefixes):
+            return False
+        return None
+
+    def evaluate(self, expr, depth=0):
+        """
+        Evaluates the condition of #if or #elif directive.
+        Returns the integer value, or None if the value depends on the unknown macros or can't be evaluated
+        """
+        tokens = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            m = condition_token_re.match(expr, pos)
+            if m is None:
+                return None
+            tokens.append(m.group(m.lastindex))
+            pos = m.end()
+        evaluator = ConditionEvaluator(self, tokens, depth)
+        try:
+            value = evaluator.conditional()
+        except (IndexError, ValueError):
+            return None
+        if evaluator.pos != len(tokens):
+            return None
+        return value
+
+
+class ConditionEvaluator(object):
+    """
+    Recursive descent evaluator of the tokenized preprocessor condition, the values are integers or None if unknown
+    """
+
+    def __init__(self, env, tokens, depth):
+        self.env = env
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = depth
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def expect(self, token):
+        if self.next() != token:
+            raise ValueError(token)
+
+    def conditional(self):
+        value = self.binary(1)
+        if self.peek() != "?":
+            return value
+        self.next()
+        true_value = self.conditional()
+        self.expect(":")
+        false_value = self.conditional()
+        if value is None:
+            return true_value if true_value == false_value else None
+        return true_value if value else false_value
+
+    def binary(self, min_precedence):
+        value = self.unary()
+        while 1:
+            op = self.peek()
+            precedence = condition_binary_operators.get(op)
+            if precedence is None or precedence < min_precedence:
+                return value
+            self.next()
+            rhs = self.binary(precedence + 1)
+            if op == "&&":
+                if value == 0 or rhs == 0:
+                    value = 0
+                elif value is None or rhs is None:
+                    value = None
+                else:
+                    value = 1
+            elif op == "||":
+                if value or rhs:
+                    value = 1
+                elif value is None or rhs is None:
+                    value = None
+                else:
+                    value = 0
+            elif value is None or rhs is None:
+                value = None
+            else:
+                value = condition_operator_funcs[op](value, rhs)
+
+    def unary(self):
+        token = self.next()
+        if token in ("!", "-", "+", "~"):
+            value = self.unary()
+            if value is None:
+                return None
+            if token == "!":
+                return int(not value)
+            if token == "-":
+                return -value
+            if token == "~":
+                return ~value
+            return value
+        if token == "(":
+            value = self.conditional()
+            self.expect(")")
+            return value
+        if token == "defined":
+            if self.peek() == "(":
+                self.next()
+                name = self.next()
+                self.expect(")")
+            else:
+                name = self.next()
+            defined = self.env.is_defined(name)
+            return None if defined is None else int(defined)
+        if token[0].isdigit():
+            number = token.rstrip("uUlL")
+            if len(number) > 1 and number[0] == "0" and number.isdigit():
+                return int(number, 8)
+            return int(number, 0)
+        if token[0].isalpha() or token[0] == "_":
+            if self.peek() == "(":
+                # function-like macro call
+                self.skip_parens()
+                return None
+            return self.macro_value(token)
+        raise ValueError(token)
+
+    def skip_parens(self):
+        balance = 0
+        while 1:
+            token = self.next()
+            if token == "(":
+                balance += 1
+            elif token == ")":
+                balance -= 1
+                if balance == 0:
+                    return
+
+    def macro_value(self, name):
+        env = self.env
+        if name in env.defines:
+            if self.depth > 10:
+                return None
+            return env.evaluate(env.defines[name], self.depth + 1)
+        if env.is_defined(name) is False:
+            return 0
+        return None
+
+
+class ParseError(Exception):
+    """
+    Error in the header `hname` at the line `lineno`, raised by the parser in the recover mode instead of exiting
+    """
+
+    def __init__(self, hname, lineno, message):
+        super(ParseError, self).__init__(hname, lineno, message)
+        self.hname = hname
+        self.lineno = lineno
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
 
 class CppHeaderParser(object):
+    # memo caches of parse_arg and parse_func_decl shared by the parser instances, the latter is only used in the
+    # wrap mode: in the non-wrap mode the declarations hardly ever repeat and the memo costs more than it saves
+    arg_cache = MemoCache(8192)
+    func_decl_cache = MemoCache(2048)
 
-    def __init__(self, generate_umat_decls=False):
+    def __init__(self, generate_umat_decls=False, cache=None, macros=None, docs=True, recover=False, profile=False):
+        """
+        :param cache: ParseCache to reuse the results of the previous runs or None
+        :param macros: MacroEnv to evaluate the preprocessor conditionals and skip the inactive regions, or None to parse
+            all the branches
+        :param docs: False to skip the doc comments, the docstrings are empty and there are no module comments then
+        :param recover: True to skip the statements with errors and continue, the errors are reported with the
+            "diagnostic" events and collected in `diagnostics`, otherwise the parser prints the error and exits
+        :param profile: True to measure the parse time of every header (in `header_times`) and collect the parser
+            statistics in `stats`, see profile_report(). Without it nothing is measured or counted
+        """
         self._generate_umat_decls = generate_umat_decls
+        self.cache = cache
+        self.macros = macros
+        self.docs = docs
+        self.recover = recover
+        self.diagnostics = []  # type: list[ParseError]
+        self.profile = profile
+        self.header_times = OrderedDict()
 
         self.BLOCK_TYPE = 0
         self.BLOCK_NAME = 1
@@ -45,6 +1216,39 @@ class CppHeaderParser(object):
 
         self.namespaces = set()
         self.module_comment = {}
+        self.symbols = SymbolTable()
+        self.wrap_mode = True
+        # parser statistics, only collected when profiling: the numbers of the calls and the memo cache hits of
+        # parse_arg and parse_func_decl, the parse cache hits and misses, the statements rejected by the prefilter and
+        # skipped in the block bodies and the statements of every block type
+        self.stats = Counter()
+
+    def hit_rates(self):
+        """
+        Returns the hit rates of the parse_arg and parse_func_decl memo caches, they are only counted when profiling
+        """
+        rates = {}
+        for name in ("parse_arg", "parse_func_decl"):
+            calls = self.stats[name + "_calls"]
+            rates[name] = float(self.stats[name + "_hits"]) / calls if calls else 0.0
+        return rates
+
+    @property
+    def lineno(self):
+        """
+        Number of the line of the currently parsed statement, it's only needed for the messages, so computed on demand
+        """
+        return self.source.lineno(self.token_pos)
+
+    def error(self, message, code=-1):
+        """
+        Reports the error at the current line: raises ParseError in the recover mode, prints the message and exits
+        with `code` otherwise
+        """
+        if self.recover:
+            raise ParseError(self.hname, self.lineno, message)
+        print(message)
+        sys.exit(code)
 
     def batch_replace(self, s, pairs):
         for before, after in pairs:
@@ -52,24 +1256,20 @@ class CppHeaderParser(object):
         return s
 
     def get_macro_arg(self, arg_str, npos):
-        npos2 = npos3 = arg_str.find("(", npos)
+        npos2 = arg_str.find("(", npos)
         if npos2 < 0:
-            print("Error: no arguments for the macro at %d" % (self.lineno,))
-            sys.exit(-1)
+            self.error("Error: no arguments for the macro at %d" % (self.lineno,))
         balance = 1
-        while 1:
-            t, npos3 = self.find_next_token(arg_str, ['(', ')'], npos3+1)
-            if npos3 < 0:
-                print("Error: no matching ')' in the macro call at %d" % (self.lineno,))
-                sys.exit(-1)
-            if t == '(':
+        for m in macro_paren_re.finditer(arg_str, npos2+1):
+            if m.group() == '(':
                 balance += 1
-            if t == ')':
+            else:
                 balance -= 1
                 if balance == 0:
-                    break
+                    npos3 = m.start()
+                    return arg_str[npos2+1:npos3].strip(), npos3
 
-        return arg_str[npos2+1:npos3].strip(), npos3
+        self.error("Error: no matching ')' in the macro call at %d" % (self.lineno,))
 
     def is_spaced_type_def(self, built_type, token):
         if built_type == "unsigned" and (token == "long" or token == "int" or token == "short" or token == "char"):
@@ -82,23 +1282,39 @@ class CppHeaderParser(object):
 
 
     def parse_arg(self, arg_str, argno):
+        """
+        Memoized parse_arg_uncached (see there), the results are immutable and shared
+        """
+        key = (arg_str.strip(), argno, self.wrap_mode)
+        result = self.arg_cache.get(key)
+        if self.profile:
+            self.stats["parse_arg_calls"] += 1
+            self.stats["parse_arg_hits"] += result is not None
+        if result is None:
+            result = self.parse_arg_uncached(key[0], argno)
+            self.arg_cache.put(key, result)
+        return result
+
+    def parse_arg_uncached(self, arg_str, argno):
         """
         Parses <arg_type> [arg_name]
-        Returns arg_type, arg_name, modlist, argno, where
-        modlist is the list of wrapper-related modifiers (such as "output argument", "has counter", ...)
+        Returns arg_type, arg_name, mods, arrays, argno, where
+        mods are the wrapper-related modifiers (such as "output argument", "const", ...), arrays is the pair of
+        the plain C array counter and custom array counter (or None)
         and argno is the new index of an anonymous argument.
         That is, if no arg_str is just an argument type without argument name, the argument name is set to
         "arg" + str(argno), and then argno is incremented.
         """
-        modlist = []
+        mods = NO_MODS
+        array = custom_array = None
 
         # pass 0: extracts the modifiers
         if "CV_OUT" in arg_str:
-            modlist.append("/O")
+            mods |= ModBit.O
             arg_str = arg_str.replace("CV_OUT", "")
 
         if "CV_IN_OUT" in arg_str:
-            modlist.append("/IO")
+            mods |= ModBit.IO
             arg_str = arg_str.replace("CV_IN_OUT", "")
 
         isarray = False
@@ -107,7 +1323,7 @@ class CppHeaderParser(object):
             isarray = True
             macro_arg, npos3 = self.get_macro_arg(arg_str, npos)
 
-            modlist.append("/A " + macro_arg)
+            array = macro_arg
             arg_str = arg_str[:npos] + arg_str[npos3+1:]
 
         npos = arg_str.find("CV_CUSTOM_CARRAY")
@@ -115,28 +1331,31 @@ class CppHeaderParser(object):
             isarray = True
             macro_arg, npos3 = self.get_macro_arg(arg_str, npos)
 
-            modlist.append("/CA " + macro_arg)
+            custom_array = macro_arg
             arg_str = arg_str[:npos] + arg_str[npos3+1:]
 
         npos = arg_str.find("const")
         if npos >= 0:
-            modlist.append("/C")
+            mods |= ModBit.C
 
         npos = arg_str.find("&")
         if npos >= 0:
-            modlist.append("/Ref")
+            mods |= ModBit.Ref
 
         arg_str = arg_str.strip()
         word_start = 0
         word_list = []
-        npos = -1
 
         #print self.lineno, ":\t", arg_str
 
         # pass 1: split argument type into tokens
+        delims = arg_type_delim_re.finditer(arg_str)
         while 1:
-            npos += 1
-            t, npos = self.find_next_token(arg_str, [" ", "&", "*", "<", ">", ","], npos)
+            m = next(delims, None)
+            if m is None:
+                t, npos = "", len(arg_str)
+            else:
+                t, npos = m.group(), m.start()
             w = arg_str[word_start:npos].strip()
             if w == "operator":
                 word_list.append("operator " + arg_str[npos:].strip())
@@ -148,7 +1367,6 @@ class CppHeaderParser(object):
             if not t:
                 break
             word_start = npos+1
-            npos = word_start - 1
 
         arg_type = ""
         arg_name = ""
@@ -179,14 +1397,12 @@ class CppHeaderParser(object):
                 angle_stack.append(0)
             elif w == "," or w == '>':
                 if not angle_stack:
-                    print("Error at %d: argument contains ',' or '>' not within template arguments" % (self.lineno,))
-                    sys.exit(-1)
+                    self.error("Error at %d: argument contains ',' or '>' not within template arguments" % (self.lineno,))
                 if w == ",":
                     arg_type += "_and_"
                 elif w == ">":
                     if angle_stack[0] == 0:
-                        print("Error at %s:%d: template has no arguments" % (self.hname, self.lineno))
-                        sys.exit(-1)
+                        self.error("Error at %s:%d: template has no arguments" % (self.hname, self.lineno))
                     if angle_stack[0] > 1:
                         arg_type += "_end_"
                     angle_stack[-1:] = []
@@ -211,13 +1427,12 @@ class CppHeaderParser(object):
             p1 = arg_name.find("[")
             p2 = arg_name.find("]",p1+1)
             if p2 < 0:
-                print("Error at %d: no closing ]" % (self.lineno,))
-                sys.exit(-1)
+                self.error("Error at %d: no closing ]" % (self.lineno,))
             counter_str = arg_name[p1+1:p2].strip()
             if counter_str == "":
                 counter_str = "?"
             if not isarray:
-                modlist.append("/A " + counter_str.strip())
+                array = counter_str.strip()
             arg_name = arg_name[:p1]
             add_star = True
 
@@ -236,7 +1451,7 @@ class CppHeaderParser(object):
 
         arg_type = self.batch_replace(arg_type, [("std::", ""), ("cv::", ""), ("::", "_")])
 
-        return arg_type, arg_name, modlist, argno
+        return arg_type, arg_name, mods, (array, custom_array), argno
 
     def parse_enum(self, decl_str):
         l = decl_str
@@ -257,29 +1472,30 @@ class CppHeaderParser(object):
             else:
                 prev_val_delta = 0
                 prev_val = val = pv[1].strip()
-            decl.append(["const " + self.get_dotted_name(pv[0].strip()), val, [], [], None, ""])
+            decl.append(Decl("const " + self.get_dotted_name(pv[0].strip()), val, NO_MODS, [], None, ""))
         return decl
 
     def parse_class_decl(self, decl_str):
         """
         Parses class/struct declaration start in the form:
            {class|struct} [CV_EXPORTS] <class_name> [: public <base_class1> [, ...]]
-        Returns class_name1, <list of base_classes>
+        Returns class_name1, <list of base_classes>, mods, alias
         """
         l = decl_str
-        modlist = []
+        mods = NO_MODS
+        alias = None
         if "CV_EXPORTS_W_MAP" in l:
             l = l.replace("CV_EXPORTS_W_MAP", "")
-            modlist.append("/Map")
+            mods |= ModBit.Map
         if "CV_EXPORTS_W_SIMPLE" in l:
             l = l.replace("CV_EXPORTS_W_SIMPLE", "")
-            modlist.append("/Simple")
+            mods |= ModBit.Simple
         if not bool(self.block_stack[-1][self.ACTUAL_PUBLIC_SECTION]):
-            modlist.append("/Hidden")
+            mods |= ModBit.Hidden
         npos = l.find("CV_EXPORTS_AS")
         if npos >= 0:
             macro_arg, npos3 = self.get_macro_arg(l, npos)
-            modlist.append("=" + macro_arg)
+            alias = macro_arg
             l = l[:npos] + l[npos3+1:]
 
         l = self.batch_replace(l, [("CV_EXPORTS_W", ""), ("CV_EXPORTS", ""), ("public virtual ", " "), ("public ", " "), ("::", ".")]).strip()
@@ -287,7 +1503,7 @@ class CppHeaderParser(object):
         ll = [le for le in ll if le]
         classname = ll[1]
         bases = ll[2:]
-        return classname, bases, modlist
+        return classname, bases, mods, alias
 
     def parse_func_decl_no_wrap(self, decl_str, static_method=False, docstring=""):
         decl_str = (decl_str or "").strip()
@@ -332,13 +1548,13 @@ class CppHeaderParser(object):
             apos = fdecl.find("(", apos+1)
 
         fname = "cv." + fname.replace("::", ".")
-        decl = [fname, rettype, [], [], None, docstring]
+        decl = Decl(fname, rettype, NO_MODS, [], None, docstring)
 
         # inline constructor implementation
         implmatch = re.match(r"(\(.*?\))\s*:\s*(\w+\(.*?\),?\s*)+", fdecl[apos:])
         if bool(implmatch):
             fdecl = fdecl[:apos] + implmatch.group(1)
-            decl[2].append("/I")
+            decl.mods |= ModBit.I
 
         args0str = fdecl[apos+1:fdecl.rfind(")")].strip()
 
@@ -388,26 +1604,57 @@ class CppHeaderParser(object):
                     bidx = aname.find('[')
                     atype += aname[bidx:]
                     aname = aname[:bidx]
-                decl[3].append([atype, aname, defval, []])
+                decl.args.append(Arg(atype, aname, defval))
 
-        decl[2].append("/NW")
+        mods = decl.mods | ModBit.NW
         if static_method:
-            decl[2].append("/S")
+            mods |= ModBit.S
         if virtual_method:
-            decl[2].append("/V")
+            mods |= ModBit.V
         if explicit_method:
-            decl[2].append("/E")
+            mods |= ModBit.E
         if bool(re.match(r".*\)\s*(const)?\s*=\s*0", decl_str)):
-            decl[2].append("/A")
+            mods |= ModBit.A
         if bool(re.match(r".*\)\s*const(\s*=\s*0)?", decl_str)):
-            decl[2].append("/C")
+            mods |= ModBit.C
         if not bool(self.block_stack[-1][self.ACTUAL_PUBLIC_SECTION]):
-            decl[2].append("/H")
+            mods |= ModBit.H
+        decl.mods = mods
         if "virtual" in decl_str:
             print(decl_str)
         return decl
 
     def parse_func_decl(self, decl_str, use_umat=False, docstring=""):
+        """
+        Memoized parse_func_decl_uncached (see there) in the wrap mode. The result depends on the statement and the
+        enclosing blocks, the cached declarations are copied, so the callers are free to modify the result
+        """
+        if not self.wrap_mode:
+            return self.parse_func_decl_uncached(decl_str, use_umat, docstring)
+        stack = self.block_stack
+        key = (decl_str, use_umat, self.wrap_mode, stack[-1][self.ACTUAL_PUBLIC_SECTION],
+               tuple((block[self.BLOCK_TYPE], block[self.BLOCK_NAME]) for block in stack))
+        decl = self.func_decl_cache.get(key)
+        if self.profile:
+            self.stats["parse_func_decl_calls"] += 1
+            self.stats["parse_func_decl_hits"] += decl is not None
+        if decl is None:
+            decl = self.parse_func_decl_uncached(decl_str, use_umat, docstring)
+            if self.func_decl_cache.admit(key):
+                cached = []
+                if decl:
+                    # the docstring can refer to the source of the header, it's not kept in the cache
+                    cached = decl.copy()
+                    cached.docstring = ""
+                self.func_decl_cache.put(key, cached)
+            return decl
+        if not decl:
+            return []
+        decl = decl.copy()
+        decl.docstring = docstring
+        return decl
+
+    def parse_func_decl_uncached(self, decl_str, use_umat=False, docstring=""):
         """
         Parses the function or method declaration in the form:
         [([CV_EXPORTS] <rettype>) | CVAPI(rettype)]
@@ -429,17 +1676,18 @@ class CppHeaderParser(object):
             return []
 
         top = self.block_stack[-1]
-        func_modlist = []
+        func_mods = NO_MODS
+        alias = None
 
         npos = decl_str.find("CV_EXPORTS_AS")
         if npos >= 0:
             arg, npos3 = self.get_macro_arg(decl_str, npos)
-            func_modlist.append("="+arg)
+            alias = arg
             decl_str = decl_str[:npos] + decl_str[npos3+1:]
         npos = decl_str.find("CV_WRAP_AS")
         if npos >= 0:
             arg, npos3 = self.get_macro_arg(decl_str, npos)
-            func_modlist.append("="+arg)
+            alias = arg
             decl_str = decl_str[:npos] + decl_str[npos3+1:]
 
         virtual_method = False
@@ -473,21 +1721,18 @@ class CppHeaderParser(object):
         if decl_str.startswith("CVAPI"):
             rtype_end = decl_str.find(")", args_begin+1)
             if rtype_end < 0:
-                print("Error at %d. no terminating ) in CVAPI() macro: %s" % (self.lineno, decl_str))
-                sys.exit(-1)
+                self.error("Error at %d. no terminating ) in CVAPI() macro: %s" % (self.lineno, decl_str))
             decl_str = decl_str[args_begin+1:rtype_end] + " " + decl_str[rtype_end+1:]
             args_begin = decl_str.find("(")
         if args_begin < 0:
-            print("Error at %d: no args in '%s'" % (self.lineno, decl_str))
-            sys.exit(-1)
+            self.error("Error at %d: no args in '%s'" % (self.lineno, decl_str))
 
         decl_start = decl_str[:args_begin].strip()
         # handle operator () case
         if decl_start.endswith("operator"):
             args_begin = decl_str.find("(", args_begin+1)
             if args_begin < 0:
-                print("Error at %d: no args in '%s'" % (self.lineno, decl_str))
-                sys.exit(-1)
+                self.error("Error at %d: no args in '%s'" % (self.lineno, decl_str))
             decl_start = decl_str[:args_begin].strip()
             # TODO: normalize all type of operators
             if decl_start.endswith("()"):
@@ -497,7 +1742,7 @@ class CppHeaderParser(object):
         if bool(re.match(r'^(\w+::)*(?P<x>\w+)::~?(?P=x)$', decl_start)):
             decl_start = "void " + decl_start
 
-        rettype, funcname, modlist, argno = self.parse_arg(decl_start, -1)
+        rettype, funcname, mods, arrays, argno = self.parse_arg(decl_start, -1)
 
         # determine original return type, hack for return types with underscore
         original_type = None
@@ -521,9 +1766,8 @@ class CppHeaderParser(object):
                 elif bool(re.match(r'\w+\s+\(\*\w+\)\[\d+\]', decl_str)):
                     return [] # exotic - dynamic 2d array
                 else:
-                    #print rettype, funcname, modlist, argno
-                    print("Error at %s:%d the function/method name is missing: '%s'" % (self.hname, self.lineno, decl_start))
-                    sys.exit(-1)
+                    #print rettype, funcname, mods, argno
+                    self.error("Error at %s:%d the function/method name is missing: '%s'" % (self.hname, self.lineno, decl_start))
 
         if self.wrap_mode and (("::" in funcname) or funcname.startswith("~")):
             # if there is :: in function name (and this is in the header file),
@@ -537,26 +1781,24 @@ class CppHeaderParser(object):
 
         if not self.wrap_mode:
             decl = self.parse_func_decl_no_wrap(decl_str, static_method, docstring)
-            decl[0] = funcname
+            decl.name = intern_str(funcname)
             return decl
 
         arg_start = args_begin+1
-        npos = arg_start-1
         balance = 1
         angle_balance = 0
         # scan the argument list; handle nested parentheses
         args_decls = []
         args = []
+        umat_args = []
         argno = 1
 
+        delims = arg_list_delim_re.finditer(decl_str, arg_start)
         while balance > 0:
-            npos += 1
-            t, npos = self.find_next_token(decl_str, ["(", ")", ",", "<", ">"], npos)
-            if not t:
-                print("Error: no closing ')' at %d" % (self.lineno,))
-                print(decl_str)
-                print(decl_str[arg_start:])
-                sys.exit(-1)
+            m = next(delims, None)
+            if m is None:
+                self.error("Error: no closing ')' at %d\n%s\n%s" % (self.lineno, decl_str, decl_str[arg_start:]))
+            t, npos = m.group(), m.start()
             if t == "<":
                 angle_balance += 1
             if t == ">":
@@ -574,7 +1816,6 @@ class CppHeaderParser(object):
                 if a:
                     eqpos = a.find("=")
                     defval = ""
-                    modlist = []
                     if eqpos >= 0:
                         defval = a[eqpos+1:].strip()
                     else:
@@ -589,52 +1830,72 @@ class CppHeaderParser(object):
                         defval = "0"
                     if eqpos >= 0:
                         a = a[:eqpos].strip()
-                    arg_type, arg_name, modlist, argno = self.parse_arg(a, argno)
+                    arg_type, arg_name, mods, arrays, argno = self.parse_arg(a, argno)
                     if self.wrap_mode:
-                        mat = "UMat" if use_umat else "Mat"
-
-                        # TODO: Vectors should contain UMat, but this is not very easy to support and not very needed
-                        vector_mat = "vector_{}".format("Mat")
-                        vector_mat_template = "vector<{}>".format("Mat")
-
-                        if arg_type == "InputArray":
-                            arg_type = mat
-                        elif arg_type == "InputOutputArray":
-                            arg_type = mat
-                            modlist.append("/IO")
-                        elif arg_type == "OutputArray":
-                            arg_type = mat
-                            modlist.append("/O")
-                        elif arg_type == "InputArrayOfArrays":
-                            arg_type = vector_mat
-                        elif arg_type == "InputOutputArrayOfArrays":
-                            arg_type = vector_mat
-                            modlist.append("/IO")
-                        elif arg_type == "OutputArrayOfArrays":
-                            arg_type = vector_mat
-                            modlist.append("/O")
-                        defval = self.batch_replace(defval, [("InputArrayOfArrays", vector_mat_template),
-                                                             ("InputOutputArrayOfArrays", vector_mat_template),
-                                                             ("OutputArrayOfArrays", vector_mat_template),
-                                                             ("InputArray", mat),
-                                                             ("InputOutputArray", mat),
-                                                             ("OutputArray", mat),
-                                                             ("noArray", arg_type)]).strip()
-                    args.append([arg_type, arg_name, defval, modlist])
+                        if arg_type in ("InputArray", "InputOutputArray", "OutputArray") or "Array" in defval:
+                            umat_args.append((len(args), arg_type, defval))
+                        arg_type, defval, mods = self.array_arg(arg_type, defval, mods, "UMat" if use_umat else "Mat")
+                    args.append(Arg(arg_type, arg_name, defval, mods, *arrays))
                 npos = arg_start-1
 
         if static_method:
-            func_modlist.append("/S")
+            func_mods |= ModBit.S
         if const_method:
-            func_modlist.append("/C")
+            func_mods |= ModBit.C
         if virtual_method:
-            func_modlist.append("/V")
+            func_mods |= ModBit.V
         if pure_virtual_method:
-            func_modlist.append("/PV")
+            func_mods |= ModBit.PV
+
+        func_mods |= ModBit.NW
 
-        func_modlist.append("/NW")
+        return Decl(funcname, rettype, func_mods, args, original_type, docstring, alias, tuple(umat_args) or None)
 
-        return [funcname, rettype, func_modlist, args, original_type, docstring]
+    def array_arg(self, arg_type, defval, mods, mat):
+        """
+        Replaces the InputArray family types of the wrapped function argument and its default value with the
+        matrix type `mat` ("Mat" or "UMat"), or the vector of Mat for the arrays of arrays.
+        Returns the argument type, the default value and the modifiers
+        """
+        # TODO: Vectors should contain UMat, but this is not very easy to support and not very needed
+        vector_mat = "vector_{}".format("Mat")
+        vector_mat_template = "vector<{}>".format("Mat")
+
+        if arg_type == "InputArray":
+            arg_type = mat
+        elif arg_type == "InputOutputArray":
+            arg_type = mat
+            mods |= ModBit.IO
+        elif arg_type == "OutputArray":
+            arg_type = mat
+            mods |= ModBit.O
+        elif arg_type == "InputArrayOfArrays":
+            arg_type = vector_mat
+        elif arg_type == "InputOutputArrayOfArrays":
+            arg_type = vector_mat
+            mods |= ModBit.IO
+        elif arg_type == "OutputArrayOfArrays":
+            arg_type = vector_mat
+            mods |= ModBit.O
+        defval = self.batch_replace(defval, [("InputArrayOfArrays", vector_mat_template),
+                                             ("InputOutputArrayOfArrays", vector_mat_template),
+                                             ("OutputArrayOfArrays", vector_mat_template),
+                                             ("InputArray", mat),
+                                             ("InputOutputArray", mat),
+                                             ("OutputArray", mat),
+                                             ("noArray", arg_type)]).strip()
+        return arg_type, defval, mods
+
+    def umat_decl(self, decl):
+        """
+        Returns the UMat variant of the declaration: the copy with the InputArray family arguments of the wrapped
+        functions converted to UMat instead of Mat, the same as the declaration parsed with use_umat=True
+        """
+        decl = decl.copy()
+        for i, arg_type, defval in decl.umat_args or ():
+            arg = decl.args[i]
+            arg.type, arg.defval, _ = self.array_arg(arg_type, defval, NO_MODS, "UMat")
+        return decl
 
     def get_dotted_name(self, name):
         """
@@ -653,22 +1914,41 @@ class CppHeaderParser(object):
             return name
         if name.startswith("cv."):
             return name
+        prefixes = self.name_prefixes[-1]
+        if prefixes is None:
+            self.error("Error at %d: there are non-valid entries in the current block stack %s" % (self.lineno, self.block_stack))
         qualified_name = (("." in name) or ("::" in name))
-        n = ""
-        for b in self.block_stack:
-            block_type, block_name = b[self.BLOCK_TYPE], b[self.BLOCK_NAME]
-            if block_type in ["file", "enum"]:
-                continue
-            if block_type not in ["struct", "class", "namespace"]:
-                print("Error at %d: there are non-valid entries in the current block stack " % (self.lineno, self.block_stack))
-                sys.exit(-1)
-            if block_name and (block_type == "namespace" or not qualified_name):
-                n += block_name + "."
-        n += name.replace("::", ".")
+        n = prefixes[qualified_name] + name.replace("::", ".")
         if n.endswith(".Algorithm"):
             n = "cv.Algorithm"
         return n
 
+    def push_block(self, block):
+        """
+        Pushes `block` to the block stack along with the name prefixes get_dotted_name uses inside of it: a pair of
+        (<all the enclosing class and namespace names>, <only the enclosing namespace names>), each one dot-terminated,
+        for the unqualified and the qualified names respectively. The pair is None when some block in the stack can't
+        contain named declarations.
+        """
+        block_type, block_name = block[self.BLOCK_TYPE], block[self.BLOCK_NAME]
+        prefixes = self.name_prefixes[-1] if self.name_prefixes else ("", "")
+        if prefixes is None or block_type in ("file", "enum"):
+            pass
+        elif block_type not in ("struct", "class", "namespace"):
+            prefixes = None
+        elif block_name:
+            unqualified, qualified = prefixes
+            unqualified += block_name + "."
+            if block_type == "namespace":
+                qualified += block_name + "."
+            prefixes = (unqualified, qualified)
+        self.block_stack.append(block)
+        self.name_prefixes.append(prefixes)
+
+    def pop_block(self):
+        self.block_stack[-1:] = []
+        self.name_prefixes[-1:] = []
+
     def parse_typedef(self, decl_str, docstring=""):
         # callback, e.g. typedef int (CV_CDECL* CvCmpFunc)(const void* a, const void* b, void* userdata )
         m = re.match(r"typedef\s+(.+?)\s*\(\s*.*\*\s*(\w+?)\s*\)\s*\(\s*(.+?)\s*\)\s*$", decl_str)
@@ -677,18 +1957,18 @@ class CppHeaderParser(object):
             for x in (x.strip() for x in m.group(3).split(",")):
                 ma = re.match(r"\s*(.+)\s+(\w+)\s*$", x)  # type with name, e.g. const void* a
                 if ma:
-                    args.append([ma.group(1), ma.group(2)])
+                    args.append(Arg(ma.group(1), ma.group(2)))
                 else:
                     ma = re.match(r"\s*(.+)\s*$", x)  # type w/o name, e.g. const void*
                     if ma:
-                        args.append([ma.group(1), ""])
+                        args.append(Arg(ma.group(1), ""))
                     else:
                         return None
-            return ["callback {}".format(self.get_dotted_name(m.group(2))), m.group(1), "", args, None, docstring]
+            return Decl("callback {}".format(self.get_dotted_name(m.group(2))), m.group(1), NO_MODS, args, None, docstring)
         # type alias, e.g. typedef Affine3<float> Affine3f
         m = re.match(r"typedef\s+(.+)\s+(\w+)$", decl_str)
         if m:
-            return ["typedef {}".format(self.get_dotted_name(m.group(2))), m.group(1), "", [], None, docstring]
+            return Decl("typedef {}".format(self.get_dotted_name(m.group(2))), m.group(1), NO_MODS, [], None, docstring)
         return None
 
     def parse_stmt(self, stmt, end_token, use_umat=False, docstring=""):
@@ -707,8 +1987,7 @@ class CppHeaderParser(object):
             stmt_type = "block"
 
         if context == "block":
-            print("Error at %d: should not call parse_stmt inside blocks" % (self.lineno,))
-            sys.exit(-1)
+            self.error("Error at %d: should not call parse_stmt inside blocks" % (self.lineno,))
 
         if context == "class" or context == "struct":
             while 1:
@@ -737,30 +2016,32 @@ class CppHeaderParser(object):
             if not self.wrap_mode and stmt.startswith("typedef struct"):
                 stmt_type = "struct"
                 try:
-                    classname, bases, modlist = self.parse_class_decl(stmt[len("typedef "):])
+                    classname, bases, mods, alias = self.parse_class_decl(stmt[len("typedef "):])
+                except ParseError:
+                    raise
                 except:
-                    print("Error at %s:%d" % (self.hname, self.lineno))
-                    exit(1)
+                    self.error("Error at %s:%d" % (self.hname, self.lineno), 1)
                 if classname.startswith("_Ipl"):
                     classname = classname[1:]
-                decl = [stmt_type + " " + self.get_dotted_name(classname), "", modlist, [], None, docstring]
+                decl = Decl(stmt_type + " " + self.get_dotted_name(classname), "", mods, [], None, docstring, alias)
                 if bases:
-                    decl[1] = ": " + ", ".join([self.get_dotted_name(b).replace(".","::") for b in bases])
+                    decl.rettype = ": " + ", ".join([self.get_dotted_name(b).replace(".","::") for b in bases])
                 return stmt_type, classname, True, decl
 
             if stmt.startswith("class") or stmt.startswith("struct"):
                 stmt_type = stmt.split()[0]
                 if stmt.strip() != stmt_type:
                     try:
-                        classname, bases, modlist = self.parse_class_decl(stmt)
+                        classname, bases, mods, alias = self.parse_class_decl(stmt)
+                    except ParseError:
+                        raise
                     except:
-                        print("Error at %s:%d" % (self.hname, self.lineno))
-                        exit(1)
+                        self.error("Error at %s:%d" % (self.hname, self.lineno), 1)
                     decl = []
                     if ("CV_EXPORTS_W" in stmt) or ("CV_EXPORTS_AS" in stmt) or (not self.wrap_mode):# and ("CV_EXPORTS" in stmt)):
-                        decl = [stmt_type + " " + self.get_dotted_name(classname), "", modlist, [], None, docstring]
+                        decl = Decl(stmt_type + " " + self.get_dotted_name(classname), "", mods, [], None, docstring, alias)
                         if bases:
-                            decl[1] = ": " + ", ".join([self.get_dotted_name(b).replace(".","::") for b in bases])
+                            decl.rettype = ": " + ", ".join([self.get_dotted_name(b).replace(".","::") for b in bases])
                     return stmt_type, classname, True, decl
 
             if stmt.startswith("enum"):
@@ -798,232 +2079,442 @@ class CppHeaderParser(object):
         if (context == "struct" or context == "class") and end_token == ";" and stmt:
             # looks like it's member declaration; append the members to the class declaration
             class_decl = stack_top[self.CLASS_DECL]
-            if "CV_PROP" in stmt or class_decl[0] in ("class cv.Mat", "class cv.RotatedRect", "class cv.TermCriteria", "class cv.Range", "class cv.dnn.LayerParams"): # or (class_decl and ("/Map" in class_decl[2])):
-                var_modlist = []
+            if "CV_PROP" in stmt or class_decl[0] in ("class cv.Mat", "class cv.RotatedRect", "class cv.TermCriteria", "class cv.Range", "class cv.dnn.LayerParams"): # or (class_decl and (class_decl.mods & ModBit.Map)):
+                var_mods = NO_MODS
                 if "CV_PROP_RW" in stmt:
-                    var_modlist.append("/RW")
+                    var_mods |= ModBit.RW
                 stmt = self.batch_replace(stmt, [("CV_PROP_RW", ""), ("CV_PROP", "")]).strip()
                 var_list = stmt.split(",")
-                var_type, var_name1, modlist, argno = self.parse_arg(var_list[0], -1)
+                var_type, var_name1, mods, arrays, argno = self.parse_arg(var_list[0], -1)
                 var_list = [var_name1] + [i.strip() for i in var_list[1:]]
-                var_modlist.extend(modlist)
+                var_mods |= mods
 
                 for v in var_list:
-                    class_decl[3].append([var_type, v, docstring, var_modlist])
+                    class_decl.args.append(Prop(var_type, v, docstring, var_mods, *arrays))
             return stmt_type, "", True, None
 
         # something unknown
         return stmt_type, "", False, None
 
-    def find_next_token(self, s, tlist, p=0):
+    def enter_conditional(self, directive):
         """
-        Finds the next token from the 'tlist' in the input 's', starting from position 'p'.
-        Returns the first occurred token and its position, or ("", len(s)) when no token is found
+        Updates the stack of the preprocessor conditionals with the directive.
+        Returns False if the region following the directive is inactive, True if it's active and None if it's unknown
         """
-        token = ""
-        tpos = len(s)
-        for t in tlist:
-            pos = s.find(t, p)
-            if pos < 0:
+        directive = re.sub(r"\\[^\S\n]*\n", " ", directive)
+        m = re.match(r"\s*#\s*(if|ifdef|ifndef|elif|else|endif)\b(.*)", directive, re.S)
+        if not m:
+            return True
+        kind = m.group(1)
+        expr = re.sub(r"/\*.*?(?:\*/|$)|//.*", " ", m.group(2), flags=re.S)
+        stack = self.conditionals
+        if kind == "endif" or not stack and kind in ("elif", "else"):
+            if stack:
+                stack.pop()
+            return True
+        if kind in ("if", "elif"):
+            value = self.macros.evaluate(expr)
+            cond = None if value is None else bool(value)
+        elif kind in ("ifdef", "ifndef"):
+            names = expr.split()
+            cond = self.macros.is_defined(names[0]) if names else None
+            if kind == "ifndef" and cond is not None:
+                cond = not cond
+        else:
+            cond = True
+        if kind.startswith("if"):
+            stack.append([cond, cond])
+            return cond
+        frame = stack[-1]
+        taken = frame[0]
+        if taken is True:
+            state = False
+        elif taken is False:
+            state = cond
+        else:
+            state = False if cond is False else None
+        if cond is True:
+            frame[0] = True
+        elif cond is None and taken is False:
+            frame[0] = None
+        frame[1] = state
+        return state
+
+    def skip_inactive_region(self, pos):
+        """
+        Returns the position of the #elif, #else or #endif directive closing the inactive region starting at `pos`
+        (or the end of the text), the nested conditionals are skipped as well
+        """
+        depth = 0
+        for m in self.source.conditional_re.finditer(self.source.text, pos):
+            kind = m.lastgroup
+            if kind == "open":
+                depth += 1
+            elif depth == 0:
+                return m.start()
+            elif kind == "close":
+                depth -= 1
+        return len(self.source.text)
+
+    def skip_block_body(self, pos):
+        """
+        Skips the statements of the block that is not processed, starting at the statement boundary `pos`.
+        Returns (<position>, <depth>): the end of the last statement terminator before the closing '}' of the block
+        or before the first token that needs the full parser, and the number of the nested blocks open there
+        """
+        text = self.source.text
+        ignored = self.source.ignored
+        depth = 0
+        boundary, boundary_depth = pos, 0
+        skipped = 0
+        for m in self.source.block_skip_re.finditer(text, pos):
+            kind = m.lastgroup
+            if kind == "comment":
+                if text[m.end():m.end()+4] == ignored:
+                    break
                 continue
-            if pos < tpos:
-                tpos = pos
-                token = t
-        return token, tpos
+            if kind == "line_comment" or kind == "string":
+                continue
+            if kind == "block_begin":
+                depth += 1
+            elif kind == "block_end":
+                if depth == 0:
+                    break
+                depth -= 1
+                # the nested block is a statement of the skipped block
+                skipped += depth == 0
+            elif kind == "semicolon":
+                skipped += depth == 0
+            else:
+                break
+            boundary, boundary_depth = m.end(), depth
+        if self.profile:
+            self.stats["skipped_statements"] += skipped
+        return boundary, boundary_depth
 
-    def parse(self, hname, wmode=True):
+    def parse(self, hname, wmode=True, source=None):
         """
-        The main method. Parses the input file.
+        The main method. Parses the input file, or the header content given in `source` (see iter_decls).
         Returns the list of declarations (that can be print using print_decls)
         """
-        self.hname = hname
-        decls = []
-        f = io.open(hname, 'rt', encoding='utf-8')
-        linelist = list(f.readlines())
-        f.close()
-
-        # states:
-        SCAN = 0 # outside of a comment or preprocessor directive
-        COMMENT = 1 # inside a multi-line comment
-        DIRECTIVE = 2 # inside a multi-line preprocessor directive
-        DOCSTRING = 3 # inside a multi-line docstring
-
-        state = SCAN
-
-        self.block_stack = [["file", hname, True, True, None, True]]
-        block_head = ""
-        docstring = ""
-        self.lineno = 0
-        self.wrap_mode = wmode
+        return [value for kind, value in self.iter_decls(hname, wmode, source) if kind == "decl"]
 
-        for l0 in linelist:
-            self.lineno += 1
-            #print(state, self.lineno, l0)
+    def iter_decls(self, hname, wmode=True, source=None):
+        """
+        Parses the input file, using the cache if there is one.
+        The header content can be given in `source` as str or a bytes-like buffer (e.g. bytes or mmap),
+        then `hname` is only used as the name of the header and the file is not read. The docstrings of the
+        declarations refer to the buffer until they are read, so it must not be closed before that.
+        Returns the generator of parser events, (kind, value) tuples, which are:
+            ("decl", <declaration>) as soon as the declaration is complete
+            ("namespace", <dotted namespace name>) when the namespace block is opened
+            ("module_comment", (<group name>, <docstring>)) for the docstrings with @defgroup
+            ("diagnostic", <ParseError>) for the skipped statements in the recover mode
+        Namespaces, module comments and diagnostics are collected in the parser's `namespaces`, `module_comment` and
+        `diagnostics` as well, the namespaces and the declared symbols are indexed
+        in `symbols` (see SymbolTable)
+        """
+        self.hname = hname
+        start_time = time.time() if self.profile else None
+        if source is None:
+            with io.open(hname, 'rb') as f:
+                source = f.read()
+
+        if self.cache is None:
+            events = self.iter_text_decls(source, wmode)
+        else:
+            content = source.encode("utf-8") if isinstance(source, str) else source
+            macros_key = None if self.macros is None else self.macros.key()
+            key = self.cache.key(hname, content, (wmode, self._generate_umat_decls, macros_key, self.docs, self.recover))
+            events = self.cache.load(key)
+            if self.profile:
+                self.stats["parse_cache_misses" if events is None else "parse_cache_hits"] += 1
+            if events is None:
+                events = self.cache.record(key, self.iter_text_decls(source, wmode))
+        if start_time is not None:
+            events = self.timed_events(hname, events, time.time() - start_time)
+        return self.track_events(events)
+
+    def timed_events(self, hname, events, elapsed):
+        """
+        Passes the parser events of the header through, adding the time spent on producing them to `elapsed`
+        (the time of reading the header and loading the cache), the total is stored in `header_times`
+        """
+        events = iter(events)
+        while 1:
+            start_time = time.time()
+            event = next(events, None)
+            elapsed += time.time() - start_time
+            if event is None:
+                break
+            yield event
+        self.header_times[hname] = elapsed
 
-            l = l0.strip()
+    def profile_report(self):
+        """
+        Returns the collected parse statistics as a JSON-serializable dict
+        """
+        return {
+            "header_times": self.header_times,
+            "total_time": sum(self.header_times.values()),
+            "stats": dict(sorted(self.stats.items())),
+            "memo_hit_rates": self.hit_rates(),
+        }
 
-            if state == SCAN and l.startswith("#"):
-                state = DIRECTIVE
-                # fall through to the if state == DIRECTIVE check
+    def parse_headers(self, hnames, wmode=True, jobs=1, fingerprints=None):
+        """
+        Parses the list of headers using `jobs` worker processes.
+        Yields (hname, <generator of parser events>) for every header in the order of `hnames`, see iter_decls.
+        The events of a header must be consumed before the next header, the result doesn't depend on the number of jobs.
+        With the FingerprintIndex `fingerprints` the declarations are compared with the previous run (incremental
+        mode), the parse cache makes sure only the changed headers are parsed again then
+        """
+        if jobs <= 1 or len(hnames) <= 1:
+            for hname in hnames:
+                events = self.iter_decls(hname, wmode)
+                yield hname, events if fingerprints is None else fingerprints.track(hname, events)
+            return
+        job_args = [(hname, wmode, self._generate_umat_decls, self.cache, self.macros, self.docs, self.recover,
+                     self.profile) for hname in hnames]
+        with ProcessPoolExecutor(min(jobs, len(hnames))) as executor:
+            for hname, (events, stats, header_times) in zip(hnames, executor.map(parse_header_job, job_args)):
+                self.hname = hname
+                self.stats.update(stats)
+                self.header_times.update(header_times)
+                events = self.track_events(events)
+                yield hname, events if fingerprints is None else fingerprints.track(hname, events)
+
+    def track_events(self, events):
+        """
+        Collects the namespaces, symbols, module comments and diagnostics from the parser events passing through
+        """
+        for kind, value in events:
+            if kind == "decl":
+                self.symbols.add_decl(value)
+            elif kind == "namespace":
+                self.namespaces.add(value)
+                self.symbols.add(value.replace(".", "::"), "namespace")
+            elif kind == "module_comment":
+                self.module_comment[value[0]] = value[1]
+            elif kind == "diagnostic":
+                self.diagnostics.append(value)
+            yield kind, value
+
+    def iter_text_decls(self, text, wmode):
+        """
+        Parses the header content `text` (str or bytes-like buffer), yields the parser events (see iter_decls)
+        """
+        hname = self.hname
+        # the events are held back while a class body is parsed, since the class declaration gets its properties
+        # only when the class is closed
+        events = []
+        class_level = None
+        source = self.source = HeaderSource(text)
+        decode, newline, space = source.decode, source.newline, source.space
+        lexer = HeaderLexer(source)
+
+        self.block_stack = []
+        self.name_prefixes = []
+        self.push_block(["file", hname, True, True, None, True])
+        # [<some branch is taken>, <the current branch is taken>] for the nested preprocessor conditionals
+        self.conditionals = []
+        macros = self.macros
+        # the pieces of the current statement, the text between the previous tokens
+        block_head = []
+        head_start = 0
+        # the doc comments before the current statement, see DocString
+        docs = self.docs
+        doc_ops = []
+        profile = self.profile
+        stats = self.stats
+        self.token_pos = 0
+        self.wrap_mode = wmode
 
-            if state == DIRECTIVE:
-                if not l.endswith("\\"):
-                    state = SCAN
-                define = re.match(r"#define +([A-Z_][A-Z0-9_]+) +(.+)$", l)
-                if define:
-                    decls.append(["const " + define.group(1), define.group(2), [], [], docstring])
+        for token, start, end in lexer:
+            if events and class_level is None:
+                for event in events:
+                    yield event
+                del events[:]
+
+            if token == "directive":
+                block_head.append(text[head_start:start])
+                head_start = end
+                directive = decode(text[start:end])
+                for l in directive.split("\n"):
+                    define = re.match(r"#define +([A-Z_][A-Z0-9_]+) +(.+)$", l.strip())
+                    if define:
+                        docstring = DocString(source, tuple(doc_ops)) if doc_ops else ""
+                        events.append(("decl", Decl("const " + define.group(1), define.group(2), NO_MODS, [], None, docstring)))
+                if macros is not None and self.enter_conditional(directive) is False:
+                    head_start = lexer.pos = self.skip_inactive_region(end)
                 continue
 
-            if state == COMMENT:
-                pos = l.find("*/")
-                if pos < 0:
-                    continue
-                l = l[pos+2:]
-                state = SCAN
-
-            if state == DOCSTRING:
-                pos = l.find("*/")
-                if pos < 0:
-                    docstring += l + "\n"
+            if token == "ignored" or token == "line_comment" or token == "comment":
+                block_head.append(text[head_start:start])
+                head_start = end
+                if not docs:
                     continue
-                docstring += l[:pos] + "\n"
-                m = re.search(r"@defgroup\s+(\w+)\b", docstring)
-                if m:
-                    self.module_comment[m.group(1)] = docstring
-                l = l[pos+2:]
-                state = SCAN
-
-            if l.startswith('CV__'): # just ignore this lines
-                #print('IGNORE: ' + l)
-                state = SCAN
+                if token == "line_comment":
+                    if text[start:start+3] == source.line_comment_doc:
+                        doc_ops.append(("line", start+3, end))
+                elif token == "comment" and text[start:start+3] == source.comment_doc:
+                    # '/**', it's a docstring
+                    end_pos = text.find(source.comment_end, start+2, end)
+                    if end_pos < 0:
+                        continue
+                    doc_ops = [("block", start+3, end_pos)]
+                    if text.find(source.defgroup, start+3, end_pos) >= 0:
+                        docstring = str(DocString(source, doc_ops))
+                        m = re.search(r"@defgroup\s+(\w+)\b", docstring)
+                        if m:
+                            events.append(("module_comment", (m.group(1), docstring)))
                 continue
 
-            if state != SCAN:
-                print("Error at %d: invalid state = %d" % (self.lineno, state))
-                sys.exit(-1)
+            self.token_pos = start
 
-            while 1:
-                token, pos = self.find_next_token(l, [";", "\"", "{", "}", "//!", "//", "/*"])
-
-                if not token:
-                    block_head += " " + l
-                    break
-
-                if token == "//":
-                    block_head += " " + l[:pos]
-                    break
-
-                if token == "//!":
-                    block_head += " " + l[:pos]
-                    docstring += l[pos+3:].lstrip() + "\n"
-                    break
-
-                if token == "/*":
-                    block_head += " " + l[:pos]
-                    end_pos = l.find("*/", pos+2)
-                    if len(l) > pos + 2 and l[pos+2] == "*":
-                        # '/**', it's a docstring
-                        if end_pos < 0:
-                            state = DOCSTRING
-                            docstring = l[pos+3:] + "\n"
-                            break
-                        else:
-                            docstring = l[pos+3:end_pos]
-
-                    elif end_pos < 0:
-                        state = COMMENT
-                        break
-                    l = l[end_pos+2:]
-                    continue
+            if token == "string":
+                block_head.append(text[head_start:end])
+                head_start = end
+                continue
 
-                if token == "\"":
-                    pos2 = pos + 1
-                    while 1:
-                        t2, pos2 = self.find_next_token(l, ["\\", "\""], pos2)
-                        if t2 == "":
-                            print("Error at %d: no terminating '\"'" % (self.lineno,))
-                            sys.exit(-1)
-                        if t2 == "\"":
-                            break
-                        pos2 += 2
-
-                    block_head += " " + l[:pos2+1]
-                    l = l[pos2+1:]
+            if token == "bad_string":
+                try:
+                    self.error("Error at %d: no terminating '\"'" % (self.lineno,))
+                except ParseError as e:
+                    # the statement is skipped up to the end of the line
+                    events.append(("diagnostic", e))
+                    block_head = []
+                    head_start = text.find(newline, start)
+                    if head_start < 0:
+                        head_start = len(text)
+                    lexer.pos = head_start
                     continue
 
-                stmt = (block_head + " " + l[:pos]).strip()
-                stmt = " ".join(stmt.split()) # normalize the statement
-                #print(stmt)
-                stack_top = self.block_stack[-1]
-
-                if stmt.startswith("@"):
-                    # Objective C ?
-                    break
+            # the end of a statement or a block head: ';', '{', '}' or '};'
+            token = decode(text[start:start+1])
+            block_head.append(text[head_start:start])
+            stack_top = self.block_stack[-1]
+            if profile:
+                stats["statements_in_" + stack_top[self.BLOCK_TYPE]] += 1
+            head = space.join(block_head)
+            if wmode and token != "}" and stack_top[self.PROCESS_FLAG] and stack_top[self.BLOCK_TYPE] not in ("block", "enum") \
+                    and source.paren in head and not source.export_marker_re.search(head):
+                # a function declaration without the export markers, see export_marker_pattern
+                stmt = None
+            else:
+                stmt = " ".join(decode(head).split()) # normalize the statement
+            #print(stmt)
+
+            if stmt is not None and stmt.startswith("@"):
+                # Objective C ? skip the rest of the line, keeping the statement text from the previous lines
+                block_head[-1] = text[head_start:text.rfind(newline, head_start, start)+1]
+                head_start = text.find(newline, start)
+                if head_start < 0:
+                    head_start = len(text)
+                lexer.pos = head_start
+                continue
 
-                decl = None
-                if stack_top[self.PROCESS_FLAG]:
-                    # even if stack_top[PUBLIC_SECTION] is False, we still try to process the statement,
-                    # since it can start with "public:"
-                    docstring = docstring.strip()
-                    stmt_type, name, parse_flag, decl = self.parse_stmt(stmt, token, docstring=docstring)
-                    if decl:
-                        if stmt_type == "enum":
-                            for d in decl:
-                                decls.append(d)
-                        else:
-                            decls.append(decl)
-
-                            if self._generate_umat_decls:
-                                # If function takes as one of arguments Mat or vector<Mat> - we want to create the
-                                # same declaration working with UMat (this is important for T-Api access)
-                                args = decl[3]
-                                has_mat = len([x for x in args if x[0] in {"Mat", "vector_Mat"}]) > 0
-                                if has_mat:
-                                    _, _, _, umat_decl = self.parse_stmt(stmt, token, use_umat=True, docstring=docstring)
-                                    decls.append(umat_decl)
-                        docstring = ""
-                    elif parse_flag:
-                        docstring = ""
-                    if stmt_type == "namespace":
-                        chunks = [block[1] for block in self.block_stack if block[0] == 'namespace'] + [name]
-                        self.namespaces.add('.'.join(chunks))
+            decl = None
+            if stack_top[self.PROCESS_FLAG]:
+                # even if stack_top[PUBLIC_SECTION] is False, we still try to process the statement,
+                # since it can start with "public:"
+                docstring = ""
+                if doc_ops:
+                    if doc_ops[-1][0] != "strip":
+                        doc_ops.append(("strip", 0, 0))
+                    docstring = DocString(source, tuple(doc_ops))
+                if stmt is None:
+                    if profile:
+                        stats["prefilter_rejected"] += 1
+                    stmt_type, name, parse_flag = ("block" if token == "{" else ""), "", False
                 else:
-                    stmt_type, name, parse_flag = "block", "", False
-
-                if token == "{":
-                    if stmt_type == "class":
-                        public_section = False
+                    try:
+                        stmt_type, name, parse_flag, decl = self.parse_stmt(stmt, token, docstring=docstring)
+                    except Exception as e:
+                        if not self.recover:
+                            raise
+                        if not isinstance(e, ParseError):
+                            e = ParseError(self.hname, self.lineno, "Error at %s:%d: %s: %s" % (
+                                self.hname, self.lineno, type(e).__name__, e))
+                        # the statement is skipped, the block it opens is not processed
+                        events.append(("diagnostic", e))
+                        stmt_type, name, parse_flag, decl = ("block" if token == "{" else ""), "", False, None
+                if decl:
+                    if stmt_type == "enum":
+                        for d in decl:
+                            events.append(("decl", d))
                     else:
-                        public_section = True
-                    self.block_stack.append([stmt_type, name, parse_flag, public_section, decl, public_section])
-
-                if token == "}":
-                    if not self.block_stack:
-                        print("Error at %d: the block stack is empty" % (self.lineno,))
-                    self.block_stack[-1:] = []
-                    if pos+1 < len(l) and l[pos+1] == ';':
-                        pos += 1
-
-                block_head = ""
-                l = l[pos+1:]
+                        events.append(("decl", decl))
+
+                        if self._generate_umat_decls:
+                            # If function takes as one of arguments Mat or vector<Mat> - we want to create the
+                            # same declaration working with UMat (this is important for T-Api access)
+                            has_mat = len([x for x in decl.args if x.type in {"Mat", "vector_Mat"}]) > 0
+                            if has_mat:
+                                events.append(("decl", self.umat_decl(decl)))
+                    doc_ops = []
+                elif parse_flag:
+                    doc_ops = []
+                if stmt_type == "namespace":
+                    chunks = [block[1] for block in self.block_stack if block[0] == 'namespace'] + [name]
+                    events.append(("namespace", '.'.join(chunks)))
+            else:
+                stmt_type, name, parse_flag = "block", "", False
 
-        return decls
+            if token == "{":
+                if stmt_type == "class":
+                    public_section = False
+                else:
+                    public_section = True
+                if decl is not None and class_level is None:
+                    class_level = len(self.block_stack)
+                self.push_block([stmt_type, name, parse_flag, public_section, decl, public_section])
+
+            if token == "}":
+                if not self.block_stack:
+                    print("Error at %d: the block stack is empty" % (self.lineno,))
+                self.pop_block()
+                if class_level is not None and len(self.block_stack) <= class_level:
+                    class_level = None
+
+            block_head = []
+            head_start = end
+
+            if self.block_stack and not self.block_stack[-1][self.PROCESS_FLAG]:
+                # the statements inside are not parsed, only the nested blocks would be tracked
+                head_start, depth = self.skip_block_body(end)
+                if profile:
+                    stats["skipped_bytes"] += head_start - end
+                for _ in range(depth):
+                    self.push_block(["block", "", False, True, None, True])
+                lexer.pos = head_start
+
+        for event in events:
+            yield event
 
     def print_decls(self, decls):
         """
         Prints the list of declarations, retrieived by the parse() method
         """
         for d in decls:
-            print(d[0], d[1], ";".join(d[2]))
+            print(d.name, d.rettype, ";".join(d.modlist))
             # Uncomment below line to see docstrings
-            # print('"""\n' + d[5] + '\n"""')
-            for a in d[3]:
-                print("   ", a[0], a[1], a[2], end="")
-                if a[3]:
-                    print("; ".join(a[3]))
+            # print('"""\n' + d.docstring + '\n"""')
+            for a in d.args:
+                print("   ", a.type, a.name, a[2], end="")
+                if a.modlist:
+                    print("; ".join(a.modlist))
                 else:
                     print()
 
+def parse_header_job(args):
+    """
+    Worker process entry point of CppHeaderParser.parse_headers, returns the parser events, statistics and timing
+    """
+    hname, wmode, generate_umat_decls, cache, macros, docs, recover, profile = args
+    parser = CppHeaderParser(generate_umat_decls, cache, macros, docs, recover, profile)
+    return list(parser.iter_decls(hname, wmode)), parser.stats, parser.header_times
+
 if __name__ == '__main__':
     parser = CppHeaderParser(generate_umat_decls=True)
     decls = []
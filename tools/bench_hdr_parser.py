@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of hdr_parser over the synthetic OpenCV-style headers.
+
+The corpus is generated at the scales given in the multiples of the size of the core module headers, every scale
+is parsed in a separate process in both wrap modes, measuring the lines per second and the peak memory. The run fails
+when the time per line grows with the corpus size more than allowed by --threshold, which catches the quadratic
+behaviour (string concatenation, stack walks and such) early.
+
+Usage: python3 tools/bench_hdr_parser.py [--scales 1,10,100] [--unit-lines 30000] [--threshold 1.5] [--json out.json]
+
+It's not a cargo bench and it isn't run by the CI (the timings are too noisy on the shared workers), run it by hand
+after changing hdr_parser.py: it prints SUPER-LINEAR next to the offending scale and exits with the status 1.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import hdr_parser
+
+ARG_TYPES = [
+    ("InputArray", "src", ""), ("OutputArray", "dst", ""), ("InputOutputArray", "mask", "noArray()"),
+    ("int", "flags", "0"), ("double", "scale", "1.0"), ("const Size&", "ksize", "Size()"),
+    ("const std::vector<int>&", "params", "std::vector<int>()"), ("Point", "anchor", "Point(-1,-1)"),
+    ("const String&", "name", "String()"), ("bool", "normalize", "true"), ("CV_OUT Rect*", "roi", "0"),
+    ("const Ptr<Feature2D>&", "detector", ""), ("std::vector<Mat>&", "images", ""),
+]
+RET_TYPES = ["void", "int", "double", "bool", "Mat", "String", "Ptr<Algorithm>", "std::vector<Point2f>", "Size"]
+
+
+def gen_args(rng):
+    args = []
+    with_defaults = False
+    for arg_type, name, defval in rng.sample(ARG_TYPES, rng.randint(0, 5)):
+        if defval and (with_defaults or rng.random() < 0.5):
+            with_defaults = True
+            args.append("{} {} = {}".format(arg_type, name, defval))
+        elif not with_defaults:
+            args.append("{} {}".format(arg_type, name))
+    return ", ".join(args)
+
+
+def gen_doc(rng, indent, what):
+    if rng.random() < 0.5:
+        return "{0}/** @brief {1}.\n{0}\n{0}The detailed description of {1}.\n{0}@param src the input\n{0}*/\n".format(
+            indent, what)
+    return "{0}//! {1}, see the overview\n{0}//! @sa the other one\n".format(indent, what)
+
+
+def gen_class(rng, name):
+    out = [gen_doc(rng, "", "class " + name)]
+    out.append("class CV_EXPORTS_W {} : public Algorithm\n{{\npublic:\n".format(name))
+    out.append("    enum Mode\n    {\n")
+    for i in range(rng.randint(2, 6)):
+        out.append("        {}_MODE_{} = {},\n".format(name.upper(), i, i))
+    out.append("    };\n\n")
+    for i in range(rng.randint(3, 10)):
+        out.append(gen_doc(rng, "    ", "method {}".format(i)))
+        out.append("    CV_WRAP virtual {} method{}({}) const = 0;\n\n".format(rng.choice(RET_TYPES), i, gen_args(rng)))
+    out.append("    CV_WRAP static Ptr<{0}> create({1});\n".format(name, gen_args(rng)))
+    for i in range(rng.randint(1, 4)):
+        out.append("    CV_PROP_RW double field{};\n".format(i))
+    out.append("    inline int inlineHelper(int x) const\n    {\n")
+    for i in range(rng.randint(2, 12)):
+        out.append("        if (x > {0}) {{ x -= {0}; /* }} */ }}\n".format(i))
+    out.append('        const char* s = "{ not a block }";\n        return x;\n    }\n')
+    out.append("protected:\n    void internal(int a);\n    int state_;\n};\n\n")
+    return "".join(out)
+
+
+def gen_template(rng, name):
+    out = ["template<typename _Tp> class {}\n{{\npublic:\n".format(name)]
+    out.append("    {}();\n    {}(const _Tp& v) : value(v) {{}}\n".format(name, name))
+    out.append("    _Tp get() const { return value; }\n    _Tp value;\n};\n\n")
+    out.append("template<typename _Tp> inline\n_Tp {}Sum(const std::vector<_Tp>& v)\n{{\n".format(name))
+    out.append("    _Tp s = _Tp();\n    for (size_t i = 0; i < v.size(); i++)\n    {\n        s += v[i];\n    }\n")
+    out.append("    return s;\n}\n\n")
+    return "".join(out)
+
+
+def gen_header(index):
+    """
+    Returns the text of the synthetic header number `index`, the same for the same index
+    """
+    rng = random.Random(index)
+    out = ["#ifndef BENCH_HEADER_{0}\n#define BENCH_HEADER_{0}\n\n".format(index)]
+    out.append('#include "opencv2/core.hpp"\n\n/** @defgroup bench{0} Benchmark group {0}\n*/\n\n'.format(index))
+    out.append("namespace cv {{\nnamespace bench{} {{\n\n".format(index))
+    out.append("enum Flags{}\n{{\n".format(index))
+    for i in range(rng.randint(3, 10)):
+        out.append("    FLAG{}_{} = 1 << {}, //!< flag {}\n".format(index, i, i, i))
+    out.append("};\n\n")
+    for i in range(rng.randint(2, 4)):
+        out.append(gen_class(rng, "Bench{}x{}".format(index, i)))
+        if rng.random() < 0.5:
+            out.append(gen_template(rng, "BenchTpl{}x{}".format(index, i)))
+    for i in range(rng.randint(4, 12)):
+        out.append(gen_doc(rng, "", "function {}".format(i)))
+        out.append("CV_EXPORTS_W {} benchFunction{}x{}({});\n\n".format(rng.choice(RET_TYPES), index, i, gen_args(rng)))
+    out.append("CV_EXPORTS void unexported{}(InputArray src, OutputArray dst);\n\n".format(index))
+    out.append("}} // bench{}\n}} // cv\n\n#endif\n".format(index))
+    return "".join(out)
+
+
+def run_one(lines_total, wmode):
+    """
+    Parses the synthetic headers up to `lines_total` lines, returns the measurements
+    """
+    headers = []
+    lines = 0
+    while lines < lines_total:
+        text = gen_header(len(headers))
+        headers.append(text)
+        lines += text.count("\n")
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    parser = hdr_parser.CppHeaderParser(generate_umat_decls=wmode)
+    decls = []
+    start = time.time()
+    for i, text in enumerate(headers):
+        decls.extend(parser.parse("bench{}.hpp".format(i), wmode, text))
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "headers": len(headers),
+        "lines": lines,
+        "decls": len(decls),
+        "seconds": elapsed,
+        "lines_per_sec": lines / elapsed if elapsed else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": peak_rss / 1024.0,
+        "parse_rss_mb": (peak_rss - base_rss) / 1024.0,
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="hdr_parser throughput benchmark")
+    argparser.add_argument("--scales", default="1,10,100", help="corpus sizes in the multiples of --unit-lines")
+    argparser.add_argument("--unit-lines", type=int, default=30000, help="lines of the 1x corpus (the size of core)")
+    argparser.add_argument("--threshold", type=float, default=1.5,
+                           help="allowed growth of the time per line relative to the smallest scale")
+    argparser.add_argument("--json", help="file to write the results to")
+    argparser.add_argument("--run", nargs=2, metavar=("LINES", "WMODE"), help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if args.run:
+        # a single measurement in a fresh process, so the peak memory and the parser caches are its own
+        print(json.dumps(run_one(int(args.run[0]), args.run[1] == "1")))
+        return 0
+
+    scales = [int(x) for x in args.scales.split(",")]
+    results = []
+    failed = False
+    for wmode in (False, True):
+        base = None
+        for scale in scales:
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run",
+                                           str(scale * args.unit_lines), "1" if wmode else "0"])
+            result = json.loads(out.decode())
+            result.update(scale=scale, wmode=wmode)
+            per_line = result["seconds"] / result["lines"]
+            if base is None:
+                base = per_line
+            result["slowdown"] = per_line / base
+            result["superlinear"] = result["slowdown"] > args.threshold
+            failed = failed or result["superlinear"]
+            results.append(result)
+            print("wmode={:<5} {:>4}x {:>9} lines {:>7} decls {:>8.2f}s {:>9.0f} lines/s {:>8.1f} MB peak "
+                  "{:>5.2f}x per line{}".format(str(wmode), scale, result["lines"], result["decls"], result["seconds"],
+                                                result["lines_per_sec"], result["peak_rss_mb"], result["slowdown"],
+                                                "  SUPER-LINEAR" if result["superlinear"] else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())